@@ -1,19 +1,69 @@
+import base64
 import datetime
 import glob
+import hashlib
+import io
 import json
+import mimetypes
 import os
+import re
 import shutil
+import signal
 import sys
+import threading
 import time
 
 from .bottle import (
-        Bottle, HTTPError,
-        abort, redirect, request, response, static_file)
+        Bottle, HTTPError, HTTPResponse,
+        abort, parse_date, redirect, request, response, run, static_file)
+from .assets import IMMUTABLE_CACHE_CONTROL, AssetVersions, StaticCache
+from .bundler import PageBundler
+from .cache import LRUCache
 from .cite_grabber import grab_citations
+from .compression import (
+        COMPRESS_MIN_SIZE, GzipMiddleware, accepts_encoding, precompressed_path)
+from .history import HistoryStore
+from .link_graph import LinkGraph
+from .note_index import NoteIndex, sort_key, stat_signature
+from .search_index import (
+        SearchIndex, TrigramIndex,
+        make_snippet, required_literals, snippet_at)
+from .storage import FileLock, FileWriter, WriteBehindQueue
+from .watcher import create_watcher
 
 
 app = Bottle()
 BASEDIR = None        # Will be filled in by start()
+NOTE_INDEX = None     # Will be filled in by start()
+WRITER = None         # Will be filled in by start()
+WRITE_QUEUE = None    # Will be filled in by start() if write-behind is on
+HISTORY = None        # Will be filled in by start()
+WATCHER = None        # Will be filled in by start()
+ASSETS = None         # Will be filled in by start()
+# StaticCache of a9online/static if the static cache is on
+ONLINE_ASSETS = None  # Will be filled in by start()
+STATIC_WATCHERS = []  # Will be filled in by start()
+BUNDLER = None        # Will be filled in by start() if bundling is on
+STATIC_PAGES = ('index.html', 'editor.html')
+INDEX_FILENAME = 'note-index.db'
+META_CACHE_SIZE = 50000
+# filename --> parsed metadata, validated by the stat signature
+META_CACHE = LRUCache(META_CACHE_SIZE)
+# filename --> version token, validated by the stat signature
+VERSION_CACHE = LRUCache(META_CACHE_SIZE)
+NOTE_CACHE_BYTES = 64 * 1024 * 1024
+# filename --> (meta, content, version), validated by the stat signature
+NOTE_CACHE = LRUCache(max_bytes=NOTE_CACHE_BYTES)
+# Makes checking the version and writing a note atomic, also across
+# worker processes. Will be filled in by start().
+SAVE_LOCK = None
+SAVE_LOCK_FILENAME = 'save.lock'
+SEARCH_INDEX = SearchIndex()
+TRIGRAM_INDEX = TrigramIndex()
+LINK_GRAPH = LinkGraph()
+SEARCH_LIMIT = 50
+# Serializes reading a note and updating the content indices with it
+CONTENT_LOCK = threading.Lock()
 
 
 ################################
@@ -59,24 +109,117 @@ def escape(text):
 ################################
 # Static files
 
+def static_asset(p, root):
+    """Like static_file, but sends the precompressed .gz file (see
+    lib/compression.py) instead if there is one and the client accepts it.
+    """
+    root = os.path.abspath(root)
+    filename = os.path.abspath(os.path.join(root, p.strip('/\\')))
+    gz_filename = None
+    if filename.startswith(root + os.sep) and os.path.isfile(filename):
+        gz_filename = precompressed_path(filename, os.stat(filename))
+    if gz_filename is None:
+        return static_file(p, root=root)
+    # Ranges of the compressed file would confuse clients that asked for
+    # the original, so they are only served from the original.
+    if ('HTTP_RANGE' not in request.environ
+            and accepts_encoding(request.environ, 'gzip')):
+        resp = static_file(os.path.relpath(gz_filename, root), root=root,
+                mimetype=mimetypes.guess_type(filename)[0])
+        resp.set_header('Content-Encoding', 'gzip')
+    else:
+        resp = static_file(p, root=root)
+    resp.set_header('Vary', 'Accept-Encoding')
+    return resp
+
+
+def cached_static(cache, p, on_disk=True):
+    """Serves the file from memory (a StaticCache or PageBundler).
+
+    Returns None if the file is not cached or the request is for a range
+    (left to static_file). Ranges of files that are not on the disk (such
+    as bundles) are ignored, and the whole file is sent.
+    """
+    if cache is None or (on_disk and 'HTTP_RANGE' in request.environ):
+        return None
+    cached = cache.get(p)
+    if cached is None:
+        return None
+    headers = dict(cached.headers)
+    body = cached.body
+    if cached.gz_body is not None:
+        headers['Vary'] = 'Accept-Encoding'
+        if accepts_encoding(request.environ, 'gzip'):
+            headers['Content-Encoding'] = 'gzip'
+            body = cached.gz_body
+    if 'HTTP_IF_NONE_MATCH' in request.environ:
+        not_modified = etag_matches(headers['ETag'])
+    else:
+        ims = request.environ.get('HTTP_IF_MODIFIED_SINCE')
+        ims = parse_date(ims.split(';')[0].strip()) if ims else None
+        not_modified = ims is not None and ims >= cached.mtime
+    if not_modified:
+        return HTTPResponse(status=304, **headers)
+    headers['Content-Length'] = str(len(body))
+    return HTTPResponse(body, **headers)
+
+
 @app.get('/')
 def static_slash():
     return redirect('/index.html')
 
 
+def render_page(name):
+    """Returns an HTML page of static/ with bundled scripts and stylesheets
+    (if bundling is on) and content-hashed asset URLs."""
+    with open(os.path.join(BASEDIR, 'static', name)) as fin:
+        html = fin.read()
+    if BUNDLER is not None:
+        html = BUNDLER.rewrite(name, html)
+    return ASSETS.rewrite(html)
+
+
+def static_page(name):
+    """Serves an HTML page of static/."""
+    html = render_page(name)
+    check_etag(hashlib.sha1(html.encode('utf8')).hexdigest())
+    response.content_type = 'text/html; charset=UTF-8'
+    return html
+
+
 @app.get('/index.html')
 def static_index():
-    return static_file('index.html', root=os.path.join(BASEDIR, 'static'))
+    return static_page('index.html')
 
 
 @app.get('/editor.html')
 def static_editor():
-    return static_file('editor.html', root=os.path.join(BASEDIR, 'static'))
+    return static_page('editor.html')
+
+
+@app.get('/static/bundles/<name>')
+def static_bundle(name):
+    resp = cached_static(BUNDLER, name, on_disk=False)
+    if resp is None:
+        abort(404, 'Bundle not found.')
+    if request.query.v == BUNDLER.get(name).version:
+        resp.set_header('Cache-Control', IMMUTABLE_CACHE_CONTROL)
+    return resp
 
 
 @app.get('/static/<p:path>')
 def static_path(p):
-    return static_file(p, root=os.path.join(BASEDIR, 'static'))
+    resp = None
+    if isinstance(ASSETS, StaticCache):
+        resp = cached_static(ASSETS, p)
+    if resp is None:
+        resp = static_asset(p, root=os.path.join(BASEDIR, 'static'))
+    # The URL changes with the content, so the file can be cached forever
+    version = request.query.v
+    if (version and resp.status_code in (200, 304)
+            and version == ASSETS.version(p)):
+        resp.set_header('Cache-Control', IMMUTABLE_CACHE_CONTROL)
+    return resp
 
 
 @app.get('/data/<p:path>')
@@ -88,7 +231,11 @@ def static_path(p):
 
 @app.get('/a9online/<p:path>')
 def exported_path(p):
-    return static_file(p, root=os.path.join(BASEDIR, 'a9online'))
+    if p.startswith('static/'):
+        resp = cached_static(ONLINE_ASSETS, p[len('static/'):])
+        if resp is not None:
+            return resp
+    return static_asset(p, root=os.path.join(BASEDIR, 'a9online'))
 
 
 ################################
@@ -100,6 +247,52 @@ def error_handler(error):
     return {'success': False, 'error': error.body}
 
 
+################################
+# Conditional requests
+
+def etag_matches(etag):
+    """Returns whether the If-None-Match header lists the (quoted) ETag."""
+    if_none_match = request.environ.get('HTTP_IF_NONE_MATCH', '')
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag in ('*', etag):
+            return True
+    return False
+
+
+def check_etag(etag):
+    """Set the ETag of the response, or raise 304 if the client has it."""
+    etag = f'"{etag}"'
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+    if etag_matches(etag):
+        raise HTTPResponse(status=304, **headers)
+    for key, value in headers.items():
+        response.set_header(key, value)
+
+
+def index_etag():
+    """Returns an ETag for the state of the note index.
+
+    The generation number is kept in the on-disk index, so the ETag is the
+    same in every worker process once it has pulled the latest changes.
+    """
+    NOTE_INDEX.sync()
+    return f'{NOTE_INDEX.index_id}-{NOTE_INDEX.generation}'
+
+
+def note_etag(filename):
+    """Returns an ETag of the note file computed from its stat signature.
+
+    Returns None if the note is waiting in the write-behind queue, since the
+    file on disk is stale.
+    """
+    if WRITE_QUEUE is not None and WRITE_QUEUE.get(filename) is not None:
+        return None
+    return '-'.join(f'{x:x}' for x in stat_signature(os.stat(filename)))
+
+
 ################################
 # Note
 
@@ -115,6 +308,14 @@ def validate_note_path(p, validate_extension=True):
     return filename
 
 
+def data_path(p):
+    """Normalize a path relative to the data directory.
+
+    Unlike validate_note_path, the file does not have to exist.
+    """
+    return os.path.normpath(p.strip('/\\') or '.')
+
+
 def validate_export_path(p, validate_extension=True):
     root = os.path.abspath(os.path.join(BASEDIR, 'a9online')) + os.sep
     filename = os.path.abspath(os.path.join(root, p.strip('/\\')))
@@ -144,50 +345,241 @@ def parse_meta(line):
     }
 
 
+def read_meta(filename, st):
+    """Returns the metadata of a note file with the given stat result.
+
+    The metadata line is only re-read if the stat signature changed since
+    the last time the file was read.
+    """
+    signature = stat_signature(st)
+    meta = META_CACHE.get(filename, signature)
+    if meta is None:
+        try:
+            with open(filename) as fin:
+                meta = parse_meta(fin.readline())
+        except (ValueError, IOError):
+            print(f'Warning: failed to parse metadata of {filename}')
+            meta = {'index': '', 'title': '', 'timestamp': 0}
+        META_CACHE.put(filename, signature, meta)
+    return meta
+
+
+def on_notes_changed(paths):
+    """Called from the watcher thread when notes change on disk."""
+    if paths is None:
+        NOTE_INDEX.refresh()
+    else:
+        NOTE_INDEX.update(paths)
+
+
+def encode_cursor(entry):
+    key = json.dumps(sort_key(entry)).encode('utf8')
+    return base64.urlsafe_b64encode(key).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except ValueError:
+        abort(400, 'Malformed cursor.')
+    if (not isinstance(key, list) or len(key) != 4
+            or not all(isinstance(x, str) for x in key)):
+        abort(400, 'Malformed cursor.')
+    return tuple(key)
+
+
+def parse_note(fin, filename):
+    """Returns the metadata and the content of a note file object."""
+    content = ''
+    meta_line = fin.readline()
+    try:
+        meta = parse_meta(meta_line)
+    except ValueError:
+        print(f'Warning: failed to parse metadata of {filename}')
+        meta = {'index': '', 'title': '', 'timestamp': 0}
+        content += meta_line
+    content += fin.read()
+    return meta, content
+
+
+def note_version(text):
+    """Returns the version token of the full text of a note file."""
+    return hashlib.sha1(text.encode('utf8')).hexdigest()
+
+
+def read_note_text(filename):
+    """Returns the full text of a note file and its stat signature.
+
+    Notes waiting in the write-behind queue are read from the queue (and
+    the signature is None).
+    """
+    if WRITE_QUEUE is not None:
+        text = WRITE_QUEUE.get(filename)
+        if text is not None:
+            return io.StringIO(text, newline=None).read(), None
+    with open(filename) as fin:
+        signature = stat_signature(os.fstat(fin.fileno()))
+        return fin.read(), signature
+
+
+def read_note(filename):
+    """Returns the metadata, content, and version token of a note file.
+
+    Recently read notes are served from NOTE_CACHE if the file is unchanged.
+    """
+    if WRITE_QUEUE is None or WRITE_QUEUE.get(filename) is None:
+        cached = NOTE_CACHE.get(filename, stat_signature(os.stat(filename)))
+        if cached is not None:
+            return cached
+    text, signature = read_note_text(filename)
+    meta, content = parse_note(io.StringIO(text, newline=''), filename)
+    version = note_version(text)
+    if signature is not None:
+        cache_note(filename, signature, meta, content, version)
+    return meta, content, version
+
+
+def scan_note(filename):
+    """Returns the metadata and content of a note file, bypassing NOTE_CACHE.
+
+    For the indexers and searches, which touch many notes once and would
+    otherwise push the notes being edited out of the cache.
+    """
+    text, _ = read_note_text(filename)
+    return parse_note(io.StringIO(text, newline=''), filename)
+
+
+def cache_note(filename, signature, meta, content, version):
+    META_CACHE.put(filename, signature, meta)
+    VERSION_CACHE.put(filename, signature, version)
+    NOTE_CACHE.put(filename, signature, (meta, content, version),
+            size=sys.getsizeof(content))
+
+
+def current_version(filename):
+    """Returns the version token of a note file.
+
+    The file is only re-read if its stat signature changed since it was
+    last read or written.
+    """
+    if WRITE_QUEUE is None or WRITE_QUEUE.get(filename) is None:
+        signature = stat_signature(os.stat(filename))
+        version = VERSION_CACHE.get(filename, signature)
+        if version is not None:
+            return version
+    return read_note(filename)[2]
+
+
+def check_version(filename, expected):
+    """Abort with 409 if the note is not at the expected version."""
+    if expected != current_version(filename):
+        abort(409, 'The note has been modified since it was loaded.')
+
+
+def write_note(filename, meta, content):
+    """Writes the note file and returns its new version token.
+
+    Both the old content (if it is not in the history yet, e.g., because
+    it was edited outside the app) and the new one are added to the history.
+    The new one is added once it is on the disk (see note_written), so a
+    burst of write-behind saves only adds the last one.
+    """
+    text = '<!-- {} -->\n'.format(json.dumps(meta)) + content
+    version = note_version(text)
+    if WRITE_QUEUE is None or WRITE_QUEUE.get(filename) is None:
+        path = os.path.relpath(filename, NOTE_INDEX.data_dir)
+        old_version = current_version(filename)
+        if HISTORY.latest_version(path) != old_version:
+            old_text, _ = read_note_text(filename)
+            HISTORY.add(path, old_text, note_version(old_text))
+    if WRITE_QUEUE is not None:
+        WRITE_QUEUE.write(filename, text)
+    else:
+        try:
+            WRITER.write(filename, text)
+            signature = stat_signature(os.stat(filename))
+            cache_note(filename, signature, meta, content, version)
+        except IOError:
+            abort(500, 'Failed to write note.')
+        note_written(filename, text)
+    return version
+
+
+def if_match_version():
+    """Returns the version in the If-Match header, or None to skip checks."""
+    if_match = request.environ.get('HTTP_IF_MATCH', '').strip()
+    if not if_match or if_match == '*':
+        return None
+    if if_match.startswith('W/'):
+        if_match = if_match[2:]
+    return if_match.strip('"')
+
+
+def note_written(filename, text):
+    """Called after a note is written to the disk."""
+    path = os.path.relpath(filename, NOTE_INDEX.data_dir)
+    HISTORY.add(path, text, note_version(text))
+    NOTE_INDEX.update([path])
+
+
 @app.get('/api/list')
 def list_notes():
-    notes = []
-    data_dir = os.path.join(BASEDIR, 'data')
-    for root, dirs, files in os.walk(data_dir):
-        dirname = os.path.relpath(root, data_dir)
-        for filename in files:
-            if not filename.endswith('.md'):
-                continue
-            try:
-                with open(os.path.join(root, filename)) as fin:
-                    meta = parse_meta(fin.readline())
-            except ValueError:
-                print(f'Warning: failed to parse metadata of {root}/{filename}')
-                meta = {'index': '', 'title': '', 'timestamp': 0}
-            notes.append({
-                'dirname': dirname,
-                'filename': filename,
-                'meta': meta,
-            })
-    notes.sort(
-            key=lambda x: (
-                x['dirname'],
-                (x['meta']['index'] if x['meta'] else ''),
-                (x['meta']['title'] if x['meta'] else ''),
-                x['filename']))
-    return {'notes': notes}
+    """List the notes in the sorted order.
+
+    Optional query parameters:
+    - dir: only list the notes in this directory ('.' for the root).
+    - subtree: if 1, also list the notes in the subdirectories of dir.
+    - cursor: only list the notes after the one given by the last `next`.
+    - offset, limit: pagination. `next` is null on the last page.
+    """
+    # The index is kept up to date by the watcher thread.
+    check_etag(index_etag())
+    try:
+        query = request.query
+        dirname = query.dir or None
+        if dirname is not None:
+            dirname = data_path(dirname)
+        after = decode_cursor(query.cursor) if query.cursor else None
+        try:
+            offset = int(query.offset or 0)
+            limit = int(query.limit) if query.limit else None
+        except ValueError:
+            abort(400, 'Invalid offset or limit.')
+        if offset < 0 or (limit is not None and limit <= 0):
+            abort(400, 'Invalid offset or limit.')
+        if limit is None:
+            notes = NOTE_INDEX.notes(dirname, query.subtree == '1', after)
+            return {'notes': notes[offset:], 'next': None}
+        # Fetch one more note to see if there is a next page
+        notes = NOTE_INDEX.notes(
+                dirname, query.subtree == '1', after, offset + limit + 1)
+        notes = notes[offset:]
+        next_cursor = None
+        if len(notes) > limit:
+            notes = notes[:limit]
+            next_cursor = encode_cursor(notes[-1])
+        return {'notes': notes, 'next': next_cursor}
+    except HTTPError as e:
+        return error_handler(e)
+
+
+@app.get('/api/dirs')
+def list_dirs():
+    check_etag(index_etag())
+    return {'dirs': [
+        {'dirname': dirname, 'count': count}
+        for dirname, count in NOTE_INDEX.dirs()]}
 
 
 @app.get('/api/load')
 def load_note():
     try:
         filename = validate_note_path(request.query.path)
-        with open(filename) as fin:
-            content = ''
-            meta_line = fin.readline()
-            try:
-                meta = parse_meta(meta_line)
-            except ValueError:
-                print(f'Warning: failed to parse metadata of {filename}')
-                meta = {'index': '', 'title': '', 'timestamp': 0}
-                content += meta_line
-            content += fin.read()
-        return {'meta': meta, 'content': content}
+        etag = note_etag(filename)
+        if etag is not None:
+            check_etag(etag)
+        meta, content, version = read_note(filename)
+        return {'meta': meta, 'content': content, 'version': version}
     except HTTPError as e:
         return error_handler(e)
 
@@ -202,13 +594,62 @@ def save_note():
                 'timestamp': int(time.time()),
         }
         content = request.forms.content
+        expected = if_match_version()
+        with SAVE_LOCK:
+            if expected is not None:
+                check_version(filename, expected)
+            version = write_note(filename, meta, content)
+        return {'meta': meta, 'content': content, 'version': version}
+    except HTTPError as e:
+        return error_handler(e)
+
+
+def apply_edits(content, edits):
+    """Applies a list of {from, to, text} edits to the content.
+
+    Offsets refer to the original content and count UTF-16 code units,
+    like JavaScript string indices. Edits must not overlap.
+    """
+    buf = content.encode('utf-16-le')
+    pieces = []
+    end = len(buf) // 2
+    try:
+        for edit in sorted(edits, key=lambda x: x['from'], reverse=True):
+            start, stop = int(edit['from']), int(edit['to'])
+            if not 0 <= start <= stop <= end:
+                abort(400, 'Invalid edit range.')
+            pieces.append(buf[2 * stop:2 * end])
+            pieces.append(str(edit['text']).encode('utf-16-le'))
+            end = start
+        pieces.append(buf[:2 * end])
+        return b''.join(reversed(pieces)).decode('utf-16-le')
+    except (KeyError, TypeError, ValueError):
+        abort(400, 'Malformed edits.')
+
+
+@app.post('/api/patch')
+def patch_note():
+    """Apply edits to the content of the note with the given base version.
+
+    Only the changed text has to be uploaded, unlike /api/save.
+    """
+    try:
+        filename = validate_note_path(request.forms.path)
         try:
-            with open(filename, 'w') as fout:
-                print('<!-- {} -->'.format(json.dumps(meta)), file=fout)
-                fout.write(content)
-        except IOError:
-            abort(500, 'Failed to write note.')
-        return {'meta': meta, 'content': content}
+            edits = json.loads(request.forms.edits)
+        except ValueError:
+            abort(400, 'Malformed edits.')
+        meta = {
+                'index': request.forms.index,
+                'title': request.forms.title,
+                'timestamp': int(time.time()),
+        }
+        with SAVE_LOCK:
+            _, content, version = read_note(filename)
+            if version != request.forms.base:
+                abort(409, 'The note has been modified since it was loaded.')
+            version = write_note(filename, meta, apply_edits(content, edits))
+        return {'meta': meta, 'version': version}
     except HTTPError as e:
         return error_handler(e)
 
@@ -240,6 +681,179 @@ def export_note():
         return error_handler(e)
 
 
+@app.get('/api/stats')
+def cache_stats():
+    return {
+            'meta_cache': META_CACHE.stats(),
+            'version_cache': VERSION_CACHE.stats(),
+            'note_cache': NOTE_CACHE.stats(),
+            }
+
+
+@app.get('/api/history')
+def list_history():
+    return {'revisions': HISTORY.list(data_path(request.query.path))}
+
+
+@app.get('/api/revision')
+def load_revision():
+    try:
+        path = data_path(request.query.path)
+        try:
+            revision = int(request.query.revision)
+        except ValueError:
+            abort(400, 'Invalid revision.')
+        text = HISTORY.get(path, revision)
+        if text is None:
+            abort(404, f'Revision {revision} of {path} does not exist.')
+        meta, content = parse_note(io.StringIO(text, newline=''), path)
+        return {
+                'meta': meta,
+                'content': content,
+                'version': note_version(text),
+                'revision': revision,
+                }
+    except HTTPError as e:
+        return error_handler(e)
+
+
+################################
+# Search
+
+def index_notes(updated, deleted):
+    """Update the content indices with the changed notes.
+
+    Called when the note index changes, and once for all notes on startup.
+    """
+    for path in updated:
+        with CONTENT_LOCK:
+            try:
+                meta, content = scan_note(
+                        os.path.join(NOTE_INDEX.data_dir, path))
+            except IOError:
+                SEARCH_INDEX.remove(path)
+                TRIGRAM_INDEX.remove(path)
+                LINK_GRAPH.remove(path)
+                continue
+            text = meta['title'] + '\n' + content
+            SEARCH_INDEX.update(path, text)
+            TRIGRAM_INDEX.update(path, text)
+            LINK_GRAPH.update(path, content)
+    for path in deleted:
+        with CONTENT_LOCK:
+            SEARCH_INDEX.remove(path)
+            TRIGRAM_INDEX.remove(path)
+            LINK_GRAPH.remove(path)
+
+
+def search_words(query):
+    """Returns [(path, score, snippet)] of notes containing query words."""
+    hits = []
+    for path, score in SEARCH_INDEX.search(query, SEARCH_LIMIT):
+        try:
+            _, content = scan_note(
+                    os.path.join(NOTE_INDEX.data_dir, path))
+        except IOError:
+            continue
+        hits.append((path, score, make_snippet(content, query)))
+    return hits
+
+
+def search_pattern(pattern, literals):
+    """Returns [(path, number of matches, snippet)] of notes matching the
+    compiled regular expression. Only the notes that contain the literals
+    according to the trigram index are actually searched.
+    """
+    hits = []
+    for path in TRIGRAM_INDEX.candidates(literals):
+        try:
+            meta, content = scan_note(
+                    os.path.join(NOTE_INDEX.data_dir, path))
+        except IOError:
+            continue
+        text = meta['title'] + '\n' + content
+        match = pattern.search(text)
+        if match:
+            count = sum(1 for _ in pattern.finditer(text))
+            hits.append((path, count, snippet_at(text, match.start())))
+    hits.sort(key=lambda x: (-x[1], x[0]))
+    return hits[:SEARCH_LIMIT]
+
+
+@app.get('/api/search')
+def search_notes():
+    """Search the note titles and contents.
+
+    Query parameters:
+    - q: the query.
+    - mode: 'words' (default; ranked word search), 'substring', or 'regex'.
+    - ignorecase: if 1, substring and regex searches ignore case.
+    """
+    try:
+        # Index the notes saved through other worker processes
+        NOTE_INDEX.sync()
+        query = request.query.q
+        mode = request.query.mode or 'words'
+        flags = re.IGNORECASE if request.query.ignorecase == '1' else 0
+        if mode == 'words':
+            results = search_words(query)
+        elif mode == 'substring':
+            if not query:
+                return {'hits': []}
+            results = search_pattern(
+                    re.compile(re.escape(query), flags), [query])
+        elif mode == 'regex':
+            try:
+                pattern = re.compile(query, flags | re.MULTILINE)
+                literals = required_literals(query, flags | re.MULTILINE)
+            except re.error as e:
+                abort(400, f'Invalid regular expression: {e}')
+            results = search_pattern(pattern, literals)
+        else:
+            abort(400, f'Unknown search mode {mode}.')
+        hits = []
+        for path, score, snippet in results:
+            entry = NOTE_INDEX.get(path)
+            if entry is not None:
+                hits.append(dict(entry, score=score, snippet=snippet))
+        return {'hits': hits}
+    except HTTPError as e:
+        return error_handler(e)
+
+
+################################
+# Links
+
+def link_entries(paths):
+    """Returns the sorted note entries of the given paths.
+
+    Paths that are not notes (e.g., images) get an entry without metadata.
+    """
+    entries = []
+    for path in paths:
+        entry = NOTE_INDEX.get(path)
+        if entry is None:
+            dirname, filename = os.path.split(path)
+            entry = {
+                    'dirname': dirname or '.',
+                    'filename': filename,
+                    'meta': {'index': '', 'title': '', 'timestamp': 0},
+                    }
+        entries.append(entry)
+    entries.sort(key=sort_key)
+    return entries
+
+
+@app.get('/api/backlinks')
+def list_backlinks():
+    NOTE_INDEX.sync()
+    path = data_path(request.query.path)
+    return {
+            'backlinks': link_entries(LINK_GRAPH.get_backlinks(path)),
+            'links': link_entries(LINK_GRAPH.get_links(path)),
+            }
+
+
 ################################
 # Special: citation search
 
@@ -253,9 +867,102 @@ def search_citation():
 ################################
 # Entry Point
 
-def start(port, basedir):
-    global BASEDIR
+def start_process(fsync_policy, fsync_interval, write_behind):
+    """Creates the state of the server process (or of a forked worker)."""
+    global NOTE_INDEX, WRITER, WRITE_QUEUE, HISTORY, SAVE_LOCK, WATCHER
+    WRITER = FileWriter(fsync_policy, fsync_interval)
+    HISTORY = HistoryStore(
+            os.path.join(BASEDIR, 'history'),
+            fsync=(fsync_policy == 'always'))
+    SAVE_LOCK = FileLock(os.path.join(BASEDIR, SAVE_LOCK_FILENAME))
+    if write_behind is not None:
+        WRITE_QUEUE = WriteBehindQueue(WRITER, write_behind, note_written)
+    data_dir = os.path.join(BASEDIR, 'data')
+    NOTE_INDEX = NoteIndex(
+            os.path.join(BASEDIR, INDEX_FILENAME), data_dir, read_meta)
+    # Start watching before the initial scan so that no change is missed.
+    WATCHER = create_watcher(data_dir, on_notes_changed)
+    WATCHER.start()
+    for cache in (ASSETS, ONLINE_ASSETS):
+        if isinstance(cache, StaticCache):
+            watcher = create_watcher(cache.root, cache.refresh, suffix='')
+            watcher.start()
+            STATIC_WATCHERS.append(watcher)
+    NOTE_INDEX.listeners.append(index_notes)
+    NOTE_INDEX.refresh()
+    threading.Thread(
+            target=index_notes, args=(NOTE_INDEX.paths(), []),
+            daemon=True).start()
+
+
+def stop_process():
+    if WATCHER is None:
+        # The parent of forked workers has no state
+        return
+    WATCHER.stop()
+    for watcher in STATIC_WATCHERS:
+        watcher.stop()
+    if WRITE_QUEUE is not None:
+        WRITE_QUEUE.close()
+    WRITER.close()
+    HISTORY.close()
+    SAVE_LOCK.close()
+    NOTE_INDEX.close()
+
+
+def start(port, basedir, fsync_policy='always', fsync_interval=1.0,
+          write_behind=None, note_cache_bytes=NOTE_CACHE_BYTES, threads=10,
+          workers=1, keepalive=None, gzip_min_size=COMPRESS_MIN_SIZE,
+          static_cache=False, bundle=True):
+    global BASEDIR, ASSETS, ONLINE_ASSETS, BUNDLER
     BASEDIR = basedir
     init_directories()
-    app.run(port=port)
-    print('\nGood bye!')
+    if static_cache:
+        # Loaded before forking so that the workers share the pages
+        ASSETS = StaticCache(os.path.join(BASEDIR, 'static'))
+        online_static = os.path.join(BASEDIR, 'a9online', 'static')
+        if os.path.isdir(online_static):
+            ONLINE_ASSETS = StaticCache(online_static)
+            ONLINE_ASSETS.scan()
+    else:
+        ASSETS = AssetVersions(os.path.join(BASEDIR, 'static'))
+    ASSETS.scan()
+    if bundle:
+        BUNDLER = PageBundler(os.path.join(BASEDIR, 'static'))
+        for name in STATIC_PAGES:
+            render_page(name)
+    # Stop gracefully (and flush pending writes) on SIGTERM as well
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    NOTE_CACHE.max_bytes = note_cache_bytes
+    options = {}
+    if threads > 0:
+        options.update(server='wsgiref-threaded', threads=threads)
+    if keepalive:
+        options['keepalive'] = keepalive
+    if workers > 1:
+        if write_behind is not None:
+            raise ValueError('Write-behind cannot be used with multiple workers.')
+        # Parse the changed notes once here rather than in every worker
+        note_index = NoteIndex(
+                os.path.join(BASEDIR, INDEX_FILENAME),
+                os.path.join(BASEDIR, 'data'), read_meta)
+        note_index.refresh()
+        note_index.close()
+        # Threads do not survive fork(), so each worker creates its own
+        # state after it is forked (and the parent starts no threads).
+        main_pid = os.getpid()
+
+        def start_worker():
+            if os.getppid() == main_pid:
+                start_process(fsync_policy, fsync_interval, write_behind)
+
+        os.register_at_fork(after_in_child=start_worker)
+        options['workers'] = workers
+    else:
+        start_process(fsync_policy, fsync_interval, write_behind)
+    try:
+        run(GzipMiddleware(app, gzip_min_size), port=port, **options)
+    finally:
+        stop_process()
+    if workers <= 1 or WATCHER is None:
+        print('\nGood bye!')
@@ -0,0 +1,192 @@
+"""Content hashes of the static files, for URLs that can be cached forever.
+
+The HTML pages refer to each static file as `static/<path>?v=<hash>`. Since
+the URL changes whenever the content does, responses to these URLs can be
+cached by the browser without ever being revalidated.
+
+StaticCache also keeps the files in memory, ready to be sent.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+import time
+
+from .compression import (
+        COMPRESS_MIN_SIZE, PRECOMPRESS_LEVEL, is_compressible,
+        precompressed_path)
+from .note_index import stat_signature
+
+
+HASH_LENGTH = 12
+ASSET_REF_RE = re.compile(r'''((?:href|src)=["'])static/([^"'?#]+)(["'])''')
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+STATIC_CACHE_MAX_FILE_SIZE = 4 * 1024 * 1024   # larger files stay on disk
+
+
+class AssetVersions:
+    """Content hashes of the files under root, keyed by the relative path.
+
+    All files are hashed by scan() on startup. A hash is recomputed if the
+    stat signature of the file has changed since it was computed.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.lock = threading.Lock()
+        # path --> (signature, hash)
+        self.versions = {}
+
+    def scan(self):
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if not name.endswith('.gz'):
+                    self.version(os.path.relpath(
+                        os.path.join(dirpath, name), self.root))
+
+    def version(self, path):
+        """Returns the content hash of the file, or None if there is none."""
+        path = os.path.normpath(path)
+        if os.path.isabs(path) or path.startswith(os.pardir):
+            return None
+        filename = os.path.join(self.root, path)
+        try:
+            signature = stat_signature(os.stat(filename))
+        except OSError:
+            return None
+        with self.lock:
+            cached = self.versions.get(path)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        digest = hashlib.sha1()
+        try:
+            with open(filename, 'rb') as fin:
+                for chunk in iter(lambda: fin.read(65536), b''):
+                    digest.update(chunk)
+        except OSError:
+            return None
+        version = digest.hexdigest()[:HASH_LENGTH]
+        with self.lock:
+            self.versions[path] = (signature, version)
+        return version
+
+    def rewrite(self, html):
+        """Adds ?v=<hash> to the static/ URLs in the HTML."""
+        def replace(match):
+            prefix, path, suffix = match.groups()
+            version = self.version(path)
+            if version is None:
+                return match.group(0)
+            return f'{prefix}static/{path}?v={version}{suffix}'
+        return ASSET_REF_RE.sub(replace, html)
+
+
+class CachedFile:
+    """A static file in memory, with the headers of its response."""
+
+    def __init__(self, signature, version, body, gz_body, headers):
+        self.signature = signature
+        self.mtime = signature[0] // 1000000000
+        self.version = version
+        self.body = body
+        # Gzipped body, or None if the file is not worth compressing
+        self.gz_body = gz_body
+        self.headers = headers
+
+
+class StaticCache(AssetVersions):
+    """Keeps the files under root in memory, keyed by the relative path.
+
+    Serving a cached file takes no system calls, so the files are not
+    checked on each request: refresh(paths) must be called (e.g., by a
+    watcher) when files change. The gzipped body is read from an up-to-date
+    .gz file, or else compressed once when the file is loaded.
+    """
+
+    def __init__(self, root, max_file_size=STATIC_CACHE_MAX_FILE_SIZE):
+        super().__init__(root)
+        self.max_file_size = max_file_size
+        # path --> CachedFile
+        self.files = {}
+
+    def scan(self):
+        self.refresh(None)
+
+    def refresh(self, paths):
+        """Reloads the changed files among paths, or all files if None."""
+        if paths is None:
+            with self.lock:
+                paths = set(self.files)
+            for dirpath, _, filenames in os.walk(self.root):
+                for name in filenames:
+                    paths.add(os.path.relpath(
+                        os.path.join(dirpath, name), self.root))
+        for path in paths:
+            path = os.path.normpath(path)
+            if path.endswith('.gz'):
+                # The original picks up (or drops) the .gz file
+                self.load(path[:-3], force=True)
+            else:
+                self.load(path)
+
+    def load(self, path, force=False):
+        filename = os.path.join(self.root, path)
+        try:
+            st = os.stat(filename)
+            signature = stat_signature(st)
+            cached = self.get(path)
+            if not force and cached is not None and cached.signature == signature:
+                return
+            if not os.path.isfile(filename) or st.st_size > self.max_file_size:
+                raise FileNotFoundError(filename)
+            with open(filename, 'rb') as fin:
+                body = fin.read()
+            gz_body = None
+            gz_filename = precompressed_path(filename, st)
+            if gz_filename is not None:
+                with open(gz_filename, 'rb') as fin:
+                    gz_body = fin.read()
+        except OSError:
+            with self.lock:
+                self.files.pop(path, None)
+                self.versions.pop(path, None)
+            return
+        mimetype, encoding = mimetypes.guess_type(filename)
+        mimetype = mimetype or 'application/octet-stream'
+        if encoding is not None:
+            # Already compressed (e.g., a .tar.gz file)
+            gz_body = None
+        elif (gz_body is None and is_compressible(mimetype)
+                and len(body) >= COMPRESS_MIN_SIZE):
+            gz_body = gzip.compress(body, PRECOMPRESS_LEVEL, mtime=0)
+            if len(gz_body) >= len(body):
+                gz_body = None
+        if mimetype.startswith('text/') and 'charset' not in mimetype:
+            mimetype += '; charset=UTF-8'
+        version = hashlib.sha1(body).hexdigest()[:HASH_LENGTH]
+        headers = {
+                'Content-Type': mimetype,
+                'Last-Modified': time.strftime(
+                    '%a, %d %b %Y %H:%M:%S GMT', time.gmtime(st.st_mtime)),
+                'ETag': f'"{version}"',
+                'Accept-Ranges': 'bytes',
+                }
+        if encoding is not None:
+            headers['Content-Encoding'] = encoding
+        with self.lock:
+            self.files[path] = CachedFile(
+                    signature, version, body, gz_body, headers)
+            self.versions[path] = (signature, version)
+
+    def get(self, path):
+        """Returns the CachedFile of the path, or None if it is not cached."""
+        with self.lock:
+            return self.files.get(os.path.normpath(path))
+
+    def version(self, path):
+        cached = self.get(path)
+        if cached is not None:
+            return cached.version
+        return super().version(path)
@@ -2451,6 +2451,154 @@ def redirect(url, code=None):
     raise res
 
 
+class _FilePool(object):
+    """ Keeps up to `size` files open for reading, so that the many small
+        Range requests for a large file (e.g., seeking in a video) do not
+        open it again each time. A file is reopened when its stat signature
+        changes. The handles read with os.pread(), so several requests can
+        share a descriptor without sharing a file position. """
+
+    def __init__(self, size=64):
+        self.size = size
+        self.lock = threading.Lock()
+        # filename --> [fd, signature, number of open handles]
+        self.files = {}
+        self.retired = [] # replaced or evicted entries still in use
+
+    def open(self, filename, stats):
+        """ Return a file-like handle of the file, which must be closed. """
+        if not hasattr(os, 'pread'):
+            return open(filename, 'rb')
+        signature = (stats.st_mtime_ns, stats.st_size, stats.st_ino)
+        with self.lock:
+            entry = self.files.pop(filename, None)
+            if entry is not None and entry[1] != signature:
+                self._retire(entry)
+                entry = None
+            if entry is None:
+                entry = [os.open(filename, os.O_RDONLY), signature, 0]
+            self.files[filename] = entry # most recently used last
+            entry[2] += 1
+            while len(self.files) > self.size:
+                self._retire(self.files.pop(next(iter(self.files))))
+        return _PooledFile(self, entry)
+
+    def _retire(self, entry):
+        if entry[2]:
+            self.retired.append(entry)
+        else:
+            os.close(entry[0])
+
+    def release(self, entry):
+        with self.lock:
+            entry[2] -= 1
+            if not entry[2] and entry in self.retired:
+                self.retired.remove(entry)
+                os.close(entry[0])
+
+
+class _PooledFile(object):
+    """ Read-only file-like handle of a descriptor in a :class:`_FilePool`. """
+    mode = 'rb'
+
+    def __init__(self, pool, entry):
+        self.pool = pool
+        self.entry = entry
+        self.position = 0
+        self.closed = False
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = max(os.fstat(self.fileno()).st_size - self.position, 0)
+        data = os.pread(self.fileno(), size, self.position)
+        self.position += len(data)
+        return data
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.position
+        elif whence == 2:
+            offset += os.fstat(self.fileno()).st_size
+        self.position = offset
+        return offset
+
+    def tell(self):
+        return self.position
+
+    def fileno(self):
+        return self.entry[0]
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.pool.release(self.entry)
+
+
+_file_pool = _FilePool()
+
+
+class _FileRange(object):
+    """ File-like view of `length` bytes of an open file, starting at
+        `offset`. Servers that support ``wsgi.file_wrapper`` can send it
+        with sendfile() instead of reading it through Python. """
+
+    def __init__(self, fp, offset, length):
+        self.file = fp
+        self.offset = offset
+        self.length = length
+        self.remaining = length
+        fp.seek(offset)
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+class _MultipartRanges(object):
+    """ Body of a multipart/byteranges response: the given ranges of an
+        open file, each preceded by its part headers. """
+
+    def __init__(self, fp, ranges, headers, trailer):
+        self.fp = fp
+        self.ranges = ranges
+        self.headers = headers
+        self.trailer = trailer
+
+    def __iter__(self):
+        for (offset, end), header in zip(self.ranges, self.headers):
+            yield header
+            for part in _file_iter_range(self.fp, offset, end - offset):
+                yield part
+        yield self.trailer
+
+    def close(self):
+        if self.fp: self.fp.close()
+
+
+MAX_RANGES = 100 # Requests for more ranges than this get the whole file
+
+
+def _coalesce_ranges(ranges, gap=80):
+    """ Sort the ranges and merge those that overlap or are fewer than `gap`
+        bytes apart (about the size of the headers of a part). """
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + gap:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [tuple(r) for r in merged]
+
+
 def _file_iter_range(fp, offset, bytes, maxread=1024*1024):
     ''' Yield chunks from a range in a file. No chunk is bigger than maxread.'''
     fp.seek(offset)
@@ -2465,8 +2613,9 @@ def static_file(filename, root, mimetype='auto', download=False, charset='UTF-8'
     """ Open a file in a safe way and return :exc:`HTTPResponse` with status
         code 200, 305, 403 or 404. The ``Content-Type``, ``Content-Encoding``,
         ``Content-Length`` and ``Last-Modified`` headers are set if possible.
-        Special support for ``If-Modified-Since``, ``Range`` and ``HEAD``
-        requests.
+        Special support for ``If-Modified-Since``, ``Range`` (including
+        multiple ranges), ``If-Range`` and ``HEAD`` requests. Files are
+        opened through a pool of open descriptors.
 
         :param filename: Name or path of the file to send.
         :param root: Root path for file lookups. Should be an absolute directory
@@ -2517,20 +2666,46 @@ def static_file(filename, root, mimetype='auto', download=False, charset='UTF-8'
         headers['Date'] = time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime())
         return HTTPResponse(status=304, **headers)
 
-    body = '' if request.method == 'HEAD' else open(filename, 'rb')
+    def open_body():
+        if request.method == 'HEAD': return ''
+        return _file_pool.open(filename, stats)
 
     headers["Accept-Ranges"] = "bytes"
     ranges = request.environ.get('HTTP_RANGE')
-    if 'HTTP_RANGE' in request.environ:
-        ranges = list(parse_range_header(request.environ['HTTP_RANGE'], clen))
+    if_range = request.environ.get('HTTP_IF_RANGE', '').strip()
+    if ranges and if_range:
+        # Only send a part of the file if it is the version the client has.
+        # There is no ETag to compare to, so only dates can match.
+        if if_range.startswith(('"', 'W/')) or parse_date(if_range) != int(stats.st_mtime):
+            ranges = None
+    if ranges:
+        ranges = _coalesce_ranges(parse_range_header(ranges, clen))
         if not ranges:
-            return HTTPError(416, "Requested Range Not Satisfiable")
+            headers = {"Content-Range": "bytes */%d" % clen}
+            return HTTPError(416, "Requested Range Not Satisfiable", **headers)
+    if ranges and len(ranges) == 1:
         offset, end = ranges[0]
         headers["Content-Range"] = "bytes %d-%d/%d" % (offset, end-1, clen)
         headers["Content-Length"] = str(end-offset)
-        if body: body = _file_iter_range(body, offset, end-offset)
+        body = open_body()
+        if body: body = _FileRange(body, offset, end-offset)
         return HTTPResponse(body, status=206, **headers)
-    return HTTPResponse(body, **headers)
+    if ranges and len(ranges) <= MAX_RANGES:
+        boundary = os.urandom(16).hex()
+        part_type = headers.pop('Content-Type', 'application/octet-stream')
+        headers.pop('Content-Encoding', None)
+        parts = [tob('--%s\r\nContent-Type: %s\r\nContent-Range: bytes %d-%d/%d\r\n\r\n'
+                     % (boundary, part_type, offset, end-1, clen))
+                 for offset, end in ranges]
+        parts = [b'\r\n' + part if i else part for i, part in enumerate(parts)]
+        trailer = tob('\r\n--%s--\r\n' % boundary)
+        headers["Content-Type"] = 'multipart/byteranges; boundary=%s' % boundary
+        headers["Content-Length"] = str(sum(map(len, parts)) + len(trailer)
+                                        + sum(end - offset for offset, end in ranges))
+        body = open_body()
+        if body: body = _MultipartRanges(body, ranges, parts, trailer)
+        return HTTPResponse(body, status=206, **headers)
+    return HTTPResponse(open_body(), **headers)
 
 
 
@@ -2777,29 +2952,386 @@ class FlupFCGIServer(ServerAdapter):
         flup.server.fcgi.WSGIServer(handler, **self.options).run()
 
 
+class _RequestBody(object):
+    """ File-like object that reads at most `length` bytes of the request
+        body, so that the next request on the connection stays intact. """
+
+    def __init__(self, rfile, length):
+        self.rfile = rfile
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.rfile.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def readline(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.rfile.readline(size)
+        self.remaining -= len(data)
+        return data
+
+    def readlines(self, hint=-1):
+        return list(self)
+
+    def __iter__(self):
+        return iter(self.readline, b'')
+
+    def drain(self, limit):
+        """ Skip the unread part of the body. Returns False (and reads
+            nothing) if more than `limit` bytes are left. """
+        if self.remaining > limit:
+            return False
+        while self.remaining and self.read(min(self.remaining, 65536)):
+            pass
+        return not self.remaining
+
+
 class WSGIRefServer(ServerAdapter):
+    """ Options: ``workers`` (default: 1) pre-forks this many processes
+        that accept connections from the same listening socket.
+        ``keepalive`` (seconds) enables HTTP/1.1 persistent connections,
+        which are closed after being idle for that long. Each open
+        connection occupies the server, so use it with a threaded server.
+        ``sendfile_min_size`` (default: 64 KiB): files (and file ranges) of
+        at least this many bytes are sent with sendfile(). ``timeout``
+        (seconds, default: none) closes connections that send nothing for
+        that long while a request is read (``keepalive`` takes its place
+        when it is set). """
+
     def run(self, app): # pragma: no cover
         from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
-        from wsgiref.simple_server import make_server
+        from wsgiref.simple_server import ServerHandler, make_server
         import socket
 
+        min_size = int(self.options.get('sendfile_min_size', 64 * 1024))
+        request_timeout = self.options.get('timeout')
+
         class FixedHandler(WSGIRequestHandler):
+            server_handler = self.sendfile_handler(ServerHandler, min_size)
+            timeout = float(request_timeout) if request_timeout else None
+
             def address_string(self): # Prevent reverse DNS lookups please.
                 return self.client_address[0]
             def log_request(*args, **kw):
                 if not self.quiet:
                     return WSGIRequestHandler.log_request(*args, **kw)
 
+            def handle(self):
+                # Same as WSGIRequestHandler.handle, with our ServerHandler
+                try:
+                    self.raw_requestline = self.rfile.readline(65537)
+                    if len(self.raw_requestline) > 65536:
+                        self.requestline = self.request_version = self.command = ''
+                        self.send_error(414)
+                        return
+                    if not self.parse_request():
+                        return
+                except OSError: # Timed out or reset
+                    return
+                handler = self.server_handler(
+                    self.rfile, self.wfile, self.get_stderr(),
+                    self.get_environ(), multithread=True)
+                handler.request_handler = self
+                self.server.run_handler(handler)
+
+        keepalive = self.options.get('keepalive')
+        if keepalive:
+            FixedHandler = self.keepalive_handler(FixedHandler, float(keepalive))
+
         handler_cls = self.options.get('handler_class', FixedHandler)
         server_cls  = self.options.get('server_class', WSGIServer)
 
+        if not hasattr(server_cls, 'run_handler'):
+            class server_cls(server_cls):
+                def run_handler(self, handler):
+                    handler.run(self.get_app())
+
         if ':' in self.host: # Fix wsgiref for IPv6 addresses.
             if getattr(server_cls, 'address_family') == socket.AF_INET:
                 class server_cls(server_cls):
                     address_family = socket.AF_INET6
 
         srv = make_server(self.host, self.port, app, server_cls, handler_cls)
-        srv.serve_forever()
+        workers = int(self.options.get('workers', 1))
+        if workers > 1:
+            self.prefork(srv, workers)
+        else:
+            srv.serve_forever()
+
+    def sendfile_handler(self, base_cls, min_size): # pragma: no cover
+        """ Returns a subclass of the wsgiref ServerHandler that sends files
+            returned through ``wsgi.file_wrapper`` (such as the responses of
+            :func:`static_file`) with socket.sendfile(), so the kernel copies
+            the data to the socket without passing it through Python. """
+
+        class SendfileServerHandler(base_cls):
+
+            def sendfile(self):
+                filelike = self.result.filelike
+                fp = getattr(filelike, 'file', filelike)
+                length = self.headers.get('Content-Length')
+                if not hasattr(fp, 'fileno') or 'b' not in getattr(fp, 'mode', ''):
+                    return False
+                if length is None or int(length) < min_size:
+                    return False
+                if not self.headers_sent:
+                    self.send_headers()
+                self._flush()
+                offset = getattr(filelike, 'offset', None)
+                if offset is None:
+                    offset = fp.tell()
+                sock = self.request_handler.connection
+                self.bytes_sent += sock.sendfile(fp, offset, int(length))
+                return True
+
+        return SendfileServerHandler
+
+    def keepalive_handler(self, base_cls, idle_timeout): # pragma: no cover
+        """ Returns a subclass of the wsgiref request handler that serves
+            several requests per connection. Responses without a
+            Content-Length are sent with chunked encoding (or close the
+            connection for HTTP/1.0 clients). """
+        ServerHandler = base_cls.server_handler
+
+        class KeepAliveServerHandler(ServerHandler):
+            http_version = '1.1'
+            chunked = False
+
+            def cleanup_headers(self):
+                ServerHandler.cleanup_headers(self)
+                handler = self.request_handler
+                if 'Content-Length' not in self.headers:
+                    if handler.request_version == 'HTTP/1.1':
+                        self.headers['Transfer-Encoding'] = 'chunked'
+                        self.chunked = True
+                    else:
+                        handler.close_connection = True
+                if handler.close_connection:
+                    self.headers['Connection'] = 'close'
+                elif handler.request_version != 'HTTP/1.1':
+                    self.headers['Connection'] = 'keep-alive'
+
+            def write(self, data):
+                if not self.headers_sent:
+                    # Decide the framing (in cleanup_headers) first
+                    self.bytes_sent = len(data)
+                    self.send_headers()
+                    self.bytes_sent = 0
+                if self.chunked:
+                    if not data:
+                        return
+                    data = tob('%x\r\n' % len(data)) + data + b'\r\n'
+                ServerHandler.write(self, data)
+
+            def finish_content(self):
+                ServerHandler.finish_content(self)
+                if self.chunked:
+                    self._write(b'0\r\n\r\n')
+                    self._flush()
+
+            def handle_error(self):
+                self.request_handler.close_connection = True
+                ServerHandler.handle_error(self)
+
+        class KeepAliveHandler(base_cls):
+            protocol_version = 'HTTP/1.1'
+            timeout = idle_timeout
+            wbufsize = -1               # send headers and body together
+            disable_nagle_algorithm = True
+
+            def handle(self):
+                self.close_connection = True
+                self.handle_one_request()
+                while not self.close_connection:
+                    self.handle_one_request()
+
+            def handle_expect_100(self):
+                # wfile is buffered, but the client waits for this line
+                # before sending the body.
+                result = base_cls.handle_expect_100(self)
+                self.wfile.flush()
+                return result
+
+            def handle_one_request(self):
+                self.close_connection = True
+                try:
+                    self.raw_requestline = self.rfile.readline(65537)
+                except OSError: # Timed out or reset while idle
+                    return
+                if not self.raw_requestline:
+                    return
+                if len(self.raw_requestline) > 65536:
+                    self.requestline = self.request_version = self.command = ''
+                    self.send_error(414)
+                    return
+                try:
+                    if not self.parse_request():
+                        return
+                except OSError: # Timed out or reset while sending headers
+                    return
+                # parse_request decided close_connection from the headers
+                environ = self.get_environ()
+                try:
+                    length = max(int(environ.get('CONTENT_LENGTH') or 0), 0)
+                except ValueError:
+                    self.send_error(400, 'Bad Content-Length')
+                    return
+                if 'chunked' in environ.get('HTTP_TRANSFER_ENCODING', '').lower():
+                    # The application decodes the body itself
+                    body = self.rfile
+                    self.close_connection = True
+                else:
+                    body = _RequestBody(self.rfile, length)
+                handler = KeepAliveServerHandler(
+                    body, self.wfile, self.get_stderr(), environ,
+                    multithread=True)
+                handler.request_handler = self
+                self.server.run_handler(handler)
+                try:
+                    self.wfile.flush()
+                except OSError: # The client went away
+                    self.close_connection = True
+                    return
+                if (body is not self.rfile
+                        and not body.drain(BaseRequest.MEMFILE_MAX)):
+                    self.close_connection = True
+
+        return KeepAliveHandler
+
+    def prefork(self, srv, workers): # pragma: no cover
+        """ Serve from forked worker processes, replacing the workers that
+            exit, until interrupted. Then stop the workers with SIGTERM. """
+        import signal
+        pids = {} # pid -> start time
+
+        def spawn():
+            pid = os.fork()
+            if pid == 0:
+                pids.clear() # Not ours to stop when this worker exits
+                try:
+                    srv.serve_forever()
+                finally:
+                    # Shut down without being interrupted again
+                    signal.signal(signal.SIGINT, signal.SIG_IGN)
+                    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+            pids[pid] = time.time()
+
+        for i in range(workers):
+            spawn()
+        # The parent keeps the listening socket to pass it to replacements
+        try:
+            while True:
+                pid, status = os.wait()
+                started = pids.pop(pid, None)
+                if started is None:
+                    continue
+                if os.WIFSIGNALED(status):
+                    reason = 'was killed by signal %d' % os.WTERMSIG(status)
+                else:
+                    reason = 'exited with status %d' % os.WEXITSTATUS(status)
+                _stderr("Worker %d %s; starting a new one.\n" % (pid, reason))
+                if time.time() - started < 1:
+                    time.sleep(1) # Do not fork in a loop if workers crash
+                spawn()
+        finally:
+            srv.socket.close()
+            for pid in pids:
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except OSError:
+                    pass
+            for pid in pids:
+                try:
+                    os.waitpid(pid, 0)
+                except OSError:
+                    pass
+
+
+class ThreadedWSGIRefServer(WSGIRefServer):
+    """ The wsgiref server with a bounded pool of worker threads. Uses only
+        the standard library. Options: ``threads`` (default: 10) is the
+        number of requests served at the same time. When all workers are
+        busy, new connections wait in the listen backlog. ``timeout``
+        defaults to 10 seconds, so that idle connections do not hold the
+        workers forever. When the server stops, it waits for the requests
+        being handled to finish, and refuses new ones with 503. """
+
+    def run(self, app): # pragma: no cover
+        from wsgiref.simple_server import WSGIServer
+        import queue, threading
+
+        threads = int(self.options.pop('threads', 10))
+        self.options.setdefault('timeout', 10)
+        base_cls = self.options.get('server_class', WSGIServer)
+
+        class PooledWSGIServer(base_cls):
+            request_queue_size = max(base_cls.request_queue_size, 128)
+            slots = threading.BoundedSemaphore(threads)
+            connections = queue.Queue()
+            workers = []
+            idle = threading.Condition()
+            active = 0              # requests being handled
+            stopping = False
+
+            def process_request(self, request, client_address):
+                # Threads do not survive fork(), so they are started here
+                # (in the process that serves) rather than in __init__.
+                if not self.workers:
+                    for i in range(threads):
+                        thread = threading.Thread(target=self.work, daemon=True,
+                                                  name='bottle-%d' % i)
+                        thread.start()
+                        self.workers.append(thread)
+                self.slots.acquire()
+                self.connections.put((request, client_address))
+
+            def work(self):
+                # Daemon threads, so idle connections do not delay the exit
+                while True:
+                    self.process_request_thread(*self.connections.get())
+
+            def run_handler(self, handler):
+                cls = PooledWSGIServer
+                with cls.idle:
+                    if cls.stopping:
+                        handler.request_handler.close_connection = True
+                        handler.request_handler.send_error(503)
+                        return
+                    cls.active += 1
+                try:
+                    handler.run(self.get_app())
+                finally:
+                    with cls.idle:
+                        cls.active -= 1
+                        cls.idle.notify_all()
+
+            def serve_forever(self, *args, **kwargs):
+                try:
+                    base_cls.serve_forever(self, *args, **kwargs)
+                finally:
+                    # Let the requests in flight finish before the caller
+                    # tears down the application state.
+                    cls = PooledWSGIServer
+                    with cls.idle:
+                        cls.stopping = True
+                        while cls.active:
+                            cls.idle.wait()
+
+            def process_request_thread(self, request, client_address):
+                try:
+                    self.finish_request(request, client_address)
+                except Exception:
+                    self.handle_error(request, client_address)
+                finally:
+                    self.shutdown_request(request)
+                    self.slots.release()
+
+        self.options['server_class'] = PooledWSGIServer
+        WSGIRefServer.run(self, app)
 
 
 class CherryPyServer(ServerAdapter):
@@ -3031,6 +3563,7 @@ server_names = {
     'cgi': CGIServer,
     'flup': FlupFCGIServer,
     'wsgiref': WSGIRefServer,
+    'wsgiref-threaded': ThreadedWSGIRefServer,
     'waitress': WaitressServer,
     'cherrypy': CherryPyServer,
     'cheroot': CherootServer,
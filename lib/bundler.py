@@ -0,0 +1,415 @@
+"""Bundles of the scripts and stylesheets of the HTML pages.
+
+The editor loads some 30 scripts and stylesheets, and on a high-latency
+link the page spends most of its loading time on the number of requests.
+A PageBundler concatenates the local `static/` files referred to by a page
+into one script and one stylesheet (minified in order), and rewrites the
+page to load those instead. The bundles live in memory and are rebuilt
+when a source file changes.
+
+    python3 -m lib.bundler
+
+builds the bundles of the pages and checks them (see main).
+"""
+import argparse
+import gzip
+import hashlib
+import os
+import posixpath
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+
+from .assets import HASH_LENGTH, CachedFile
+from .compression import PRECOMPRESS_LEVEL
+from .note_index import stat_signature
+
+
+BUNDLE_DIR = 'bundles'    # served as static/bundles/<name>
+SCRIPT_TAG_RE = re.compile(
+        r'''[ \t]*<script src=["']static/([^"'?#]+\.js)["']></script>\n?''')
+STYLESHEET_TAG_RE = re.compile(
+        r'''[ \t]*<link rel=["']stylesheet["'] href=["']static/([^"'?#]+\.css)["']\s*/?>\n?''')
+# Comments that have to stay (license notices): block comments, and the
+# line comments at the start of a script
+KEEP_COMMENT_RE = re.compile(r'^/\*!|@preserve|copyright|\blicen[cs]e\b', re.I)
+
+
+################################
+# Minification
+
+JS_WORD_RE = re.compile(r'[\w$\\\u0080-\U0010ffff]+')
+JS_NUMBER_RE = re.compile(
+        r'0[xXbBoO][0-9a-fA-F_]+n?'
+        r'|(?:\d[\d_]*\.?[\d_]*|\.\d[\d_]*)(?:[eE][+-]?\d+)?n?')
+# After these words, a slash starts a regular expression
+JS_REGEX_KEYWORDS = {
+        'return', 'typeof', 'instanceof', 'in', 'of', 'new', 'delete', 'void',
+        'throw', 'case', 'do', 'else', 'yield', 'await'}
+# After these tokens, a slash may start either a division or a regular
+# expression (e.g., `if (x) /re/.test(s)`, `}\n/re/.test(s)`, `i++ / 2`)
+JS_AMBIGUOUS_SLASH_PREV = {')', '}', '++', '--'}
+# Adjacent characters that must stay apart (e.g., `a - -b`, `/re/ /2`)
+JS_UNSAFE_PAIRS = {'++', '--', '//', '/*', '<!', '->'}
+
+
+def _is_word_char(c):
+    return c.isalnum() or c in '_$\\.' or ord(c) > 127
+
+
+def _js_separator(whitespace, prev, cur):
+    """Returns what is left of whitespace between two tokens."""
+    if not whitespace or not prev:
+        return ''
+    if whitespace == '\n':
+        # Line breaks can end statements, so only drop the safe ones
+        if prev[-1] in '{[(,;' or cur[0] in '}]),;':
+            return ''
+        return '\n'
+    if (_is_word_char(prev[-1]) and _is_word_char(cur[0])
+            or prev[-1] + cur[0] in JS_UNSAFE_PAIRS):
+        return ' '
+    return ''
+
+
+def minify_js(text):
+    """Removes comments and redundant whitespace from JavaScript.
+
+    Only whitespace and comments are touched, never the tokens, and line
+    breaks that might end a statement are kept. License comments are kept
+    (block comments, and line comments before the first token).
+    Where a slash could start either a division or a regular expression,
+    the text up to the end of the would-be regular expression is copied as
+    is, since it reads the same either way. Raises ValueError if even that
+    is not safe (the text holds quotes or braces), so that the file can be
+    left unminified.
+    """
+    out = []
+    whitespace = ''
+    prev = ''            # the last token
+    prev_kind = None     # 'word', 'literal', or 'punct'
+    depths = []          # brace depth in each enclosing ${...} of templates
+    i, n = 0, len(text)
+
+    def emit(token, kind):
+        nonlocal whitespace, prev, prev_kind
+        out.append(_js_separator(whitespace, prev, token))
+        out.append(token)
+        whitespace, prev, prev_kind = '', token, kind
+
+    def scan_template(start):
+        # Returns the end of the template chunk starting at text[start]
+        j = start
+        while j < n:
+            if text[j] == '\\':
+                j += 2
+            elif text[j] == '`':
+                return j + 1, False
+            elif text.startswith('${', j):
+                return j + 2, True
+            else:
+                j += 1
+        raise ValueError('Unterminated template literal')
+
+    def scan_regex(start):
+        # Returns the end of the regular expression literal starting at
+        # text[start], or None if it would not end on this line
+        j = start + 1
+        in_class = False
+        while j < n and (in_class or text[j] != '/'):
+            if text[j] == '\\':
+                j += 1
+            elif text[j] == '[':
+                in_class = True
+            elif text[j] == ']':
+                in_class = False
+            elif text[j] in '\r\n\u2028\u2029':
+                return None
+            j += 1
+        if j >= n:
+            return None
+        j += 1
+        while j < n and (text[j].isalnum() or text[j] in '_$'):
+            j += 1
+        return j
+
+    while i < n:
+        c = text[i]
+        if c in ' \t\r\n\f\v\ufeff\u00a0\u2028\u2029':
+            if c in '\r\n\u2028\u2029':
+                whitespace = '\n'
+            elif not whitespace:
+                whitespace = ' '
+            i += 1
+        elif text.startswith('//', i):
+            j = text.find('\n', i)
+            j = n if j < 0 else j
+            comment = text[i:j]
+            i = j
+            if not prev and KEEP_COMMENT_RE.search(comment):
+                out.append(comment + '\n')
+            else:
+                whitespace = whitespace or ' '
+        elif text.startswith('/*', i):
+            j = text.find('*/', i + 2)
+            if j < 0:
+                raise ValueError('Unterminated comment')
+            comment = text[i:j + 2]
+            i = j + 2
+            if KEEP_COMMENT_RE.search(comment):
+                emit(comment, 'punct')
+                whitespace = '\n'
+            elif '\n' in comment:
+                whitespace = '\n'
+            else:
+                whitespace = whitespace or ' '
+        elif c in '\'"':
+            j = i + 1
+            while j < n and text[j] != c:
+                j += 2 if text[j] == '\\' else 1
+            if j >= n:
+                raise ValueError('Unterminated string')
+            emit(text[i:j + 1], 'literal')
+            i = j + 1
+        elif c == '`' or (c == '}' and depths and depths[-1] == 0):
+            if c == '}':
+                depths.pop()
+            j, opened = scan_template(i + 1)
+            if opened:
+                depths.append(0)
+            emit(text[i:j], 'literal' if not opened else 'punct')
+            i = j
+        elif c == '/' and prev_kind == 'punct' and (
+                prev in JS_AMBIGUOUS_SLASH_PREV
+                or ''.join(out[-3:]) in JS_AMBIGUOUS_SLASH_PREV):
+            j = scan_regex(i)
+            if j is None:
+                # Not a regular expression, which has to end on its line
+                emit(c, 'punct')
+                i += 1
+                continue
+            chunk = text[i:j]
+            if any(x in chunk for x in '\'"`{}') or '//' in chunk or '/*' in chunk:
+                raise ValueError(
+                        f'Cannot tell division from regular expression: {chunk}')
+            emit(chunk, 'literal')
+            i = j
+        elif c == '/' and (prev_kind in (None, 'punct') and prev != ']'
+                           or prev_kind == 'word' and prev in JS_REGEX_KEYWORDS):
+            j = scan_regex(i)
+            if j is None:
+                raise ValueError('Unterminated regular expression')
+            emit(text[i:j], 'literal')
+            i = j
+        else:
+            match = (JS_NUMBER_RE.match(text, i) if c.isdigit() or c == '.'
+                     else JS_WORD_RE.match(text, i))
+            if match and match.end() > i:
+                emit(match.group(), 'literal' if c.isdigit() else 'word')
+                i = match.end()
+                continue
+            if depths:
+                if c == '{':
+                    depths[-1] += 1
+                elif c == '}':
+                    depths[-1] -= 1
+            emit(c, 'punct')
+            i += 1
+    return ''.join(out)
+
+
+def minify_css(text):
+    """Removes comments and redundant whitespace from CSS."""
+    out = []
+    for token in re.split(r'''("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*'|/\*.*?\*/)''',
+                          text, flags=re.S):
+        if token.startswith('/*'):
+            if KEEP_COMMENT_RE.search(token):
+                out.append(token + '\n')
+        elif token.startswith(('"', "'")):
+            out.append(token)
+        else:
+            token = re.sub(r'\s+', ' ', token)
+            # Spaces around these are never needed (but they are in
+            # selectors like `a :hover` and in calc(1px + 2px))
+            token = re.sub(r' ?([{};,>~]) ?', r'\1', token)
+            token = re.sub(r'([^ ]): ', r'\1:', token)
+            token = token.replace(';}', '}')
+            out.append(token)
+    return ''.join(out).strip() + '\n'
+
+
+def rebase_css_urls(text, path):
+    """Rewrites the relative url()s of the stylesheet at static/<path> to
+    be relative to the bundle directory."""
+    def replace(match):
+        quote, url = match.group(1), match.group(2)
+        if re.match(r'^(?:[a-z][a-z0-9+.-]*:|/|#)', url, re.I):
+            return match.group(0)
+        url = posixpath.normpath(posixpath.join(posixpath.dirname(path), url))
+        url = posixpath.relpath(url, BUNDLE_DIR)
+        return f'url({quote}{url}{quote})'
+    return re.sub(r'''url\(\s*(["']?)([^"')]+)\1\s*\)''', replace, text)
+
+
+################################
+# Bundles
+
+class PageBundler:
+    """Builds the script and stylesheet bundles of HTML pages under root.
+
+    The bundles of the page `editor.html` are `editor.js` and `editor.css`,
+    served as `static/bundles/<name>` from get(). Bundles are built when the
+    page is rewritten, and rebuilt when one of their sources has changed
+    since.
+    """
+
+    def __init__(self, root, minify=True):
+        self.root = root
+        self.minify = minify
+        self.lock = threading.Lock()
+        # bundle name --> (signatures of the sources, CachedFile)
+        self.bundles = {}
+
+    def rewrite(self, name, html):
+        """Replaces the scripts and stylesheets of the page with bundles."""
+        base = os.path.splitext(name)[0]
+        for tag_re, ext, content_type in (
+                (STYLESHEET_TAG_RE, '.css', 'text/css; charset=UTF-8'),
+                (SCRIPT_TAG_RE, '.js', 'text/javascript; charset=UTF-8')):
+            sources = tag_re.findall(html)
+            if not sources:
+                continue
+            bundle_name = base + ext
+            try:
+                bundle = self.build(bundle_name, sources, content_type)
+            except (OSError, ValueError) as e:
+                print(f'Warning: cannot bundle {bundle_name}: {e}', file=sys.stderr)
+                continue
+            url = f'static/{BUNDLE_DIR}/{bundle_name}?v={bundle.version}'
+            if ext == '.css':
+                tag = f'  <link rel="stylesheet" href="{url}" />\n'
+            else:
+                tag = f'  <script src="{url}"></script>\n'
+            # The bundle takes the place of the first tag
+            tags = [tag]
+            html = tag_re.sub(lambda m: tags.pop() if tags else '', html)
+        return html
+
+    def build(self, name, sources, content_type):
+        """Returns the CachedFile of the bundle, rebuilt if it is stale."""
+        filenames = [os.path.join(self.root, src) for src in sources]
+        signatures = [stat_signature(os.stat(x)) for x in filenames]
+        with self.lock:
+            cached = self.bundles.get(name)
+        if cached is not None and cached[0] == signatures:
+            return cached[1]
+        parts = []
+        for src, filename in zip(sources, filenames):
+            with open(filename, encoding='utf8') as fin:
+                text = fin.read()
+            if name.endswith('.css'):
+                text = rebase_css_urls(text, src)
+                if self.minify and '.min.' not in src:
+                    text = minify_css(text)
+            elif self.minify and '.min.' not in src:
+                try:
+                    text = minify_js(text)
+                except ValueError as e:
+                    print(f'Warning: {src} is bundled unminified: {e}',
+                          file=sys.stderr)
+            parts.append(f'/* {src} */\n{text.strip()}\n')
+        # Scripts are separated by ';' in case one lacks its final semicolon
+        body = (';\n' if name.endswith('.js') else '').join(parts).encode('utf8')
+        version = hashlib.sha1(body).hexdigest()[:HASH_LENGTH]
+        headers = {
+                'Content-Type': content_type,
+                'ETag': f'"{version}"',
+                'Cache-Control': 'no-cache',
+                }
+        bundle = CachedFile(
+                (max(x[0] for x in signatures), len(body), None), version, body,
+                gzip.compress(body, PRECOMPRESS_LEVEL, mtime=0), headers)
+        with self.lock:
+            self.bundles[name] = (signatures, bundle)
+        return bundle
+
+    def get(self, name):
+        """Returns the CachedFile of a built bundle, or None."""
+        with self.lock:
+            cached = self.bundles.get(name)
+        return cached[1] if cached is not None else None
+
+
+################################
+# Checks
+
+# (source, expected output) of minify_js for the cases that are easy to get
+# wrong: a slash after `)`, `}`, `++`, or `--` can be a division or start a
+# regular expression, whose spaces must survive, and license headers.
+MINIFY_JS_CHECKS = [
+        ('}\n/a  +b/.test(s)', '}\n/a  +b/.test(s)'),
+        ('if (x) /a  b/.test(s)', 'if(x)/a  b/.test(s)'),
+        ('x = i++ / 2;', 'x=i++/2;'),
+        ('x = i-- / 2 / 3;', 'x=i--/ 2 /3;'),
+        ('x = a + +/a  b/.source', 'x=a+ +/a  b/.source'),
+        ('x = a[1] / 2 / 3', 'x=a[1]/2/3'),
+        ('return /a  b/g', 'return/a  b/g'),
+        ('x = a /* c */ - -b', 'x=a- -b'),
+        ('x = `a  ${ {b: 1}.b }  c`', 'x=`a  ${{b:1}.b}  c`'),
+        ('// X, copyright (c) by Y\n// Distributed under an MIT license\n\n'
+         '// About X\nvar a = 1; // license\n',
+         '// X, copyright (c) by Y\n// Distributed under an MIT license\nvar a=1;'),
+]
+
+
+def main():
+    """Builds the bundles of the pages, and checks that the minifier gives
+    the expected output for MINIFY_JS_CHECKS and that the scripts still
+    parse (with `node --check`, if Node.js is installed)."""
+    basedir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    parser = argparse.ArgumentParser(
+            description='Build and check the bundles of the pages.')
+    parser.add_argument('pages', nargs='*',
+            default=['index.html', 'editor.html'],
+            help='Pages under static/ (default: index.html editor.html)')
+    args = parser.parse_args()
+    failed = False
+    for source, expected in MINIFY_JS_CHECKS:
+        try:
+            result = minify_js(source)
+        except ValueError as e:
+            result = f'ValueError: {e}'
+        if result != expected:
+            print(f'FAIL: minify_js({source!r}) gave {result!r}, '
+                  f'expected {expected!r}')
+            failed = True
+    node = shutil.which('node')
+    if node is None:
+        print('Warning: node is not installed; skipping the parse checks',
+              file=sys.stderr)
+    bundler = PageBundler(os.path.join(basedir, 'static'))
+    for page in args.pages:
+        with open(os.path.join(basedir, 'static', page)) as fin:
+            bundler.rewrite(page, fin.read())
+    for name, (_, bundle) in sorted(bundler.bundles.items()):
+        print(f'{name}: {len(bundle.body)} bytes, '
+              f'{len(bundle.gz_body)} gzipped')
+        if node is None or not name.endswith('.js'):
+            continue
+        with tempfile.NamedTemporaryFile(suffix='.js') as fout:
+            fout.write(bundle.body)
+            fout.flush()
+            result = subprocess.run([node, '--check', fout.name],
+                                    capture_output=True, text=True)
+        if result.returncode != 0:
+            print(f'FAIL: {name} does not parse:\n{result.stderr}')
+            failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""In-memory caches validated by file stat signatures."""
+import collections
+import threading
+
+
+class LRUCache:
+    """Bounded LRU cache whose entries are tagged with a signature.
+
+    A lookup only hits if the stored signature equals the given one, so
+    callers can pass the stat signature of a file to invalidate stale
+    entries without any explicit bookkeeping.
+
+    The cache is bounded by the number of entries, the total size of the
+    entries (as given to put), or both.
+    """
+
+    def __init__(self, max_entries=None, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # key --> (signature, value, size)
+        self.entries = collections.OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, signature):
+        """Returns the cached value, or None if absent or stale."""
+        with self.lock:
+            cached = self.entries.get(key)
+            if cached is None or cached[0] != signature:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return cached[1]
+
+    def put(self, key, signature, value, size=0):
+        with self.lock:
+            self._discard(key)
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            self.entries[key] = (signature, value, size)
+            self.total_bytes += size
+            while ((self.max_entries is not None
+                    and len(self.entries) > self.max_entries)
+                   or (self.max_bytes is not None
+                       and self.total_bytes > self.max_bytes)):
+                self.total_bytes -= self.entries.popitem(last=False)[1][2]
+                self.evictions += 1
+
+    def discard(self, key):
+        with self.lock:
+            self._discard(key)
+
+    def _discard(self, key):
+        cached = self.entries.pop(key, None)
+        if cached is not None:
+            self.total_bytes -= cached[2]
+
+    def stats(self):
+        with self.lock:
+            return {
+                    'entries': len(self.entries),
+                    'max_entries': self.max_entries,
+                    'bytes': self.total_bytes,
+                    'max_bytes': self.max_bytes,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+            }
@@ -0,0 +1,192 @@
+"""Gzip compression of responses.
+
+Dynamic responses are compressed on the fly by GzipMiddleware. Static
+files are compressed once, at build time, by running this module:
+
+    python3 -m lib.compression [directory ...]
+
+which writes a `.gz` file next to each compressible file. The server sends
+the `.gz` file as is to clients that accept gzip.
+"""
+import argparse
+import gzip
+import os
+import sys
+
+
+COMPRESS_MIN_SIZE = 1024      # smaller responses are not worth compressing
+COMPRESS_LEVEL = 6            # for dynamic responses
+PRECOMPRESS_LEVEL = 9         # for static files (compressed only once)
+COMPRESSIBLE_TYPES = (
+        'application/javascript',
+        'application/json',
+        'application/xml',
+        'image/svg+xml',
+)
+PRECOMPRESS_EXTENSIONS = (
+        '.css', '.html', '.js', '.json', '.map', '.svg', '.ttf', '.txt')
+
+
+def accepts_encoding(environ, coding):
+    """Returns whether the Accept-Encoding of the request allows the coding."""
+    for item in environ.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        name, _, params = item.partition(';')
+        if name.strip().lower() not in (coding, '*'):
+            continue
+        params = params.replace(' ', '')
+        if params.startswith('q='):
+            try:
+                return float(params[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+
+def is_compressible(content_type):
+    content_type = content_type.split(';')[0].strip().lower()
+    return content_type.startswith('text/') or content_type in COMPRESSIBLE_TYPES
+
+
+class GzipMiddleware:
+    """WSGI middleware that gzips responses if the client accepts it.
+
+    Only successful responses whose body is already in memory (a list of
+    byte strings, which is what Bottle makes of strings and dicts), with a
+    compressible type and at least min_size bytes, are compressed. Files
+    and other streamed bodies are passed through untouched.
+    """
+
+    def __init__(self, app, min_size=COMPRESS_MIN_SIZE, level=COMPRESS_LEVEL):
+        self.app = app
+        self.min_size = min_size
+        self.level = level
+
+    def __call__(self, environ, start_response):
+        if not accepts_encoding(environ, 'gzip'):
+            return self.app(environ, start_response)
+        captured = []
+
+        def capture(status, headers, exc_info=None):
+            captured[:] = [status, headers, exc_info]
+            return self.write_unsupported
+
+        result = self.app(environ, capture)
+        status, headers, exc_info = captured
+        if (status.startswith('200') and isinstance(result, (list, tuple))
+                and self.should_compress(headers)):
+            body = b''.join(result)
+            if len(body) >= self.min_size:
+                result = [gzip.compress(body, self.level, mtime=0)]
+                headers = compressed_headers(headers, len(result[0]))
+        # The compressed and the plain responses are different bytes, so
+        # only weak ETags (which 304 responses must also match) are valid.
+        headers = [(key, weak_etag(value) if key.lower() == 'etag' else value)
+                   for key, value in headers]
+        start_response(status, headers, exc_info)
+        return result
+
+    def should_compress(self, headers):
+        content_type = ''
+        for key, value in headers:
+            key = key.lower()
+            if key == 'content-encoding':
+                return False
+            if key == 'content-type':
+                content_type = value
+        return is_compressible(content_type)
+
+    @staticmethod
+    def write_unsupported(data):
+        raise NotImplementedError('GzipMiddleware does not support write().')
+
+
+def weak_etag(etag):
+    return etag if etag.startswith('W/') else 'W/' + etag
+
+
+def compressed_headers(headers, length):
+    """Returns the headers of the response after compressing it."""
+    result = []
+    vary = ['Accept-Encoding']
+    for key, value in headers:
+        lower = key.lower()
+        if lower == 'content-length':
+            continue
+        if lower == 'vary':
+            vary.extend(x.strip() for x in value.split(',')
+                        if x.strip().lower() != 'accept-encoding')
+            continue
+        result.append((key, value))
+    result.append(('Content-Encoding', 'gzip'))
+    result.append(('Content-Length', str(length)))
+    result.append(('Vary', ', '.join(vary)))
+    return result
+
+
+################################
+# Precompressed static files
+
+def precompressed_path(filename, st):
+    """Returns the path of the up-to-date .gz file of the file, or None.
+
+    The .gz file is up to date if it has the same mtime as the file (see
+    precompress).
+    """
+    gz_filename = filename + '.gz'
+    try:
+        gz_st = os.stat(gz_filename)
+    except OSError:
+        return None
+    if gz_st.st_mtime_ns != st.st_mtime_ns:
+        return None
+    return gz_filename
+
+
+def precompress(root, min_size=COMPRESS_MIN_SIZE, level=PRECOMPRESS_LEVEL):
+    """Writes a .gz file next to each compressible file under root.
+
+    Files whose .gz file is up to date are skipped. The .gz file gets the
+    mtime of the original so that stale ones can be detected. Returns the
+    number of files written and the number of bytes saved.
+    """
+    written = saved = 0
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            if not name.endswith(PRECOMPRESS_EXTENSIONS):
+                continue
+            filename = os.path.join(dirpath, name)
+            st = os.stat(filename)
+            if st.st_size < min_size or precompressed_path(filename, st):
+                continue
+            with open(filename, 'rb') as fin:
+                data = gzip.compress(fin.read(), level, mtime=0)
+            if len(data) >= st.st_size:
+                continue
+            with open(filename + '.gz', 'wb') as fout:
+                fout.write(data)
+            os.utime(filename + '.gz', ns=(st.st_atime_ns, st.st_mtime_ns))
+            written += 1
+            saved += st.st_size - len(data)
+    return written, saved
+
+
+def main():
+    basedir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    parser = argparse.ArgumentParser(
+            description='Write .gz files next to the static files.')
+    parser.add_argument('dirs', nargs='*',
+            default=[os.path.join(basedir, 'static')],
+            help='Directories to compress (default: static/)')
+    parser.add_argument('-m', '--min-size', type=int, default=COMPRESS_MIN_SIZE)
+    args = parser.parse_args()
+    for root in args.dirs:
+        if not os.path.isdir(root):
+            print(f'Warning: {root} is not a directory', file=sys.stderr)
+            continue
+        written, saved = precompress(root, args.min_size)
+        print(f'{root}: compressed {written} files, saved {saved} bytes')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+"""Append-only store of the past revisions of notes.
+
+Revisions are appended to a pack file as zlib-compressed records: either
+the full text, or a line-based delta against the previous revision of
+the same note. A SQLite index maps (path, revision) to the record, so
+finding a revision is a B-tree lookup, and rebuilding it applies at most
+KEYFRAME_INTERVAL deltas.
+"""
+import difflib
+import json
+import os
+import sqlite3
+import time
+import zlib
+
+from .storage import FileLock
+
+
+KEYFRAME_INTERVAL = 20   # store the full text at least this often
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS revisions (
+    path TEXT NOT NULL,
+    revision INTEGER NOT NULL,
+    timestamp INTEGER NOT NULL,
+    version TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    is_delta INTEGER NOT NULL,
+    PRIMARY KEY (path, revision)
+)
+'''
+
+
+def make_delta(base, text):
+    """Returns a list of [start, end] (copy base lines) or inserted text."""
+    base_lines = base.splitlines(keepends=True)
+    lines = text.splitlines(keepends=True)
+    delta = []
+    matcher = difflib.SequenceMatcher(None, base_lines, lines)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            delta.append([i1, i2])
+        elif j1 < j2:
+            delta.append(''.join(lines[j1:j2]))
+    return delta
+
+
+def apply_delta(base, delta):
+    base_lines = base.splitlines(keepends=True)
+    return ''.join(
+            ''.join(base_lines[op[0]:op[1]]) if isinstance(op, list) else op
+            for op in delta)
+
+
+class HistoryStore:
+
+    def __init__(self, dirname, fsync=False):
+        os.makedirs(dirname, exist_ok=True)
+        self.pack_path = os.path.join(dirname, 'history.pack')
+        self.fsync = fsync
+        # Several worker processes may append to the same pack file
+        self.lock = FileLock(os.path.join(dirname, 'history.lock'))
+        self.conn = sqlite3.connect(
+                os.path.join(dirname, 'history.db'), check_same_thread=False)
+        self.conn.execute(SCHEMA)
+        self.conn.commit()
+        self.pack = open(self.pack_path, 'ab')
+
+    def add(self, path, text, version):
+        """Appends a revision of the note unless it equals the latest one.
+
+        Returns the revision number.
+        """
+        with self.lock:
+            latest = self.conn.execute(
+                    'SELECT revision, version FROM revisions WHERE path = ? '
+                    'ORDER BY revision DESC LIMIT 1', (path,)).fetchone()
+            if latest is not None and latest[1] == version:
+                return latest[0]
+            revision = 0 if latest is None else latest[0] + 1
+            record = text
+            if revision % KEYFRAME_INTERVAL != 0:
+                delta = make_delta(self._get(path, revision - 1), text)
+                if len(json.dumps(delta)) < len(json.dumps(text)):
+                    record = delta
+            data = zlib.compress(json.dumps(record).encode('utf8'))
+            offset = self.pack.seek(0, os.SEEK_END)
+            self.pack.write(data)
+            self.pack.flush()
+            if self.fsync:
+                os.fsync(self.pack.fileno())
+            # The record only becomes visible once it is in the index
+            with self.conn:
+                self.conn.execute(
+                        'INSERT INTO revisions VALUES (?,?,?,?,?,?,?,?)',
+                        (path, revision, int(time.time()), version, len(text),
+                         offset, len(data), isinstance(record, list)))
+            return revision
+
+    def latest_version(self, path):
+        with self.lock:
+            row = self.conn.execute(
+                    'SELECT version FROM revisions WHERE path = ? '
+                    'ORDER BY revision DESC LIMIT 1', (path,)).fetchone()
+            return row[0] if row is not None else None
+
+    def list(self, path):
+        """Returns the revisions of the note, newest first."""
+        with self.lock:
+            rows = self.conn.execute(
+                    'SELECT revision, timestamp, version, size FROM revisions '
+                    'WHERE path = ? ORDER BY revision DESC', (path,))
+            return [{
+                'revision': revision,
+                'timestamp': timestamp,
+                'version': version,
+                'size': size,
+            } for revision, timestamp, version, size in rows]
+
+    def get(self, path, revision):
+        """Returns the full text of the revision, or None if not found."""
+        with self.lock:
+            return self._get(path, revision)
+
+    def _get(self, path, revision):
+        # Walk back to the closest full text, then apply the deltas
+        records = []
+        rows = self.conn.execute(
+                'SELECT revision, offset, length, is_delta FROM revisions '
+                'WHERE path = ? AND revision <= ? ORDER BY revision DESC',
+                (path, revision))
+        for rev, offset, length, is_delta in rows:
+            if not records and rev != revision:
+                return None
+            records.append((offset, length))
+            if not is_delta:
+                break
+        if not records:
+            return None
+        with open(self.pack_path, 'rb') as fin:
+            text = None
+            for offset, length in reversed(records):
+                fin.seek(offset)
+                record = json.loads(zlib.decompress(fin.read(length)))
+                text = record if text is None else apply_delta(text, record)
+        return text
+
+    def close(self):
+        with self.lock:
+            self.pack.close()
+            self.conn.close()
+        self.lock.close()
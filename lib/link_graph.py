@@ -0,0 +1,63 @@
+"""Index of the `@/path` links between notes."""
+import os
+import re
+import threading
+
+
+LINK_RES = [
+        # [text](@/path) and ![alt](@/path)
+        re.compile(r'\]\(\s*<?@/([^)\s>]+)'),
+        # [id]: @/path
+        re.compile(r'^\s*\[[^\]]+\]:\s*<?@/(\S+?)>?(?:\s|$)', re.M),
+        # <a href="@/path"> and <img src="@/path">
+        re.compile(r'''(?:href|src)\s*=\s*["']@/([^"']+)'''),
+]
+
+
+def extract_links(content):
+    """Returns the set of data paths linked from the note content."""
+    targets = set()
+    for link_re in LINK_RES:
+        for match in link_re.finditer(content):
+            target = re.split('[#?]', match.group(1))[0]
+            if target:
+                targets.add(os.path.normpath(target))
+    return targets
+
+
+class LinkGraph:
+    """Forward and backward links between notes, keyed by data path."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # source --> set of targets
+        self.links = {}
+        # target --> set of sources
+        self.backlinks = {}
+
+    def update(self, path, content):
+        targets = extract_links(content)
+        with self.lock:
+            self._remove(path)
+            self.links[path] = targets
+            for target in targets:
+                self.backlinks.setdefault(target, set()).add(path)
+
+    def remove(self, path):
+        with self.lock:
+            self._remove(path)
+
+    def _remove(self, path):
+        for target in self.links.pop(path, ()):
+            sources = self.backlinks[target]
+            sources.discard(path)
+            if not sources:
+                del self.backlinks[target]
+
+    def get_links(self, path):
+        with self.lock:
+            return set(self.links.get(path, ()))
+
+    def get_backlinks(self, path):
+        with self.lock:
+            return set(self.backlinks.get(path, ()))
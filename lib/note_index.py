@@ -0,0 +1,485 @@
+"""Persistent on-disk index of note metadata.
+
+Each row remembers the (mtime, size, inode) signature of the note at the
+time its metadata line was parsed, so refreshing the index only re-reads
+the notes that actually changed on disk.
+
+Several processes can share the same index file. Each write bumps the
+generation number stored in the file and tags the written rows with it,
+so the other processes can pull just the rows that changed since the
+generation they last saw.
+"""
+import argparse
+import base64
+import bisect
+import concurrent.futures
+import os
+import sqlite3
+import stat
+import sys
+import tempfile
+import threading
+import time
+
+from .storage import is_local_filesystem
+
+
+SCHEMA_VERSION = 2
+SCHEMA = ['''
+DROP TABLE IF EXISTS notes
+''', '''
+DROP TABLE IF EXISTS deleted
+''', '''
+DROP TABLE IF EXISTS state
+''', '''
+CREATE TABLE notes (
+    path TEXT PRIMARY KEY,
+    dirname TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    meta_index TEXT NOT NULL,
+    meta_title TEXT NOT NULL,
+    meta_timestamp INTEGER NOT NULL,
+    generation INTEGER NOT NULL
+)
+''', '''
+CREATE TABLE deleted (
+    path TEXT PRIMARY KEY,
+    generation INTEGER NOT NULL
+)
+''', '''
+CREATE TABLE state (
+    key TEXT PRIMARY KEY,
+    value
+)
+''', f'''
+PRAGMA user_version = {SCHEMA_VERSION}
+''']
+SCAN_WORKERS = 8      # threads used to list directories and read metadata
+
+
+def stat_signature(st):
+    """Returns the tuple used to detect whether a file has changed."""
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+def sort_key(entry):
+    return (
+            entry['dirname'],
+            entry['meta']['index'],
+            entry['meta']['title'],
+            entry['filename'])
+
+
+class NoteIndex:
+    """Metadata of all notes under data_dir, backed by a SQLite file.
+
+    read_meta(filename, st) should return the parsed metadata dict of a note
+    whose stat result is st. It is called from multiple threads.
+
+    Functions in `listeners` are called as listener(updated, deleted) with
+    the lists of note paths that were added or modified, and removed,
+    including the changes pulled from other processes.
+    """
+
+    def __init__(self, db_path, data_dir, read_meta, workers=SCAN_WORKERS):
+        self.db_path = db_path
+        self.data_dir = data_dir
+        self.read_meta = read_meta
+        self.workers = workers
+        # Listing directories in parallel only pays when reads are slow
+        self.local = is_local_filesystem(data_dir)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        # WAL lets readers (other workers) run during a write, but it needs
+        # shared memory, which does not work over network file systems.
+        journal_mode = 'WAL' if is_local_filesystem(
+                os.path.dirname(os.path.abspath(db_path))) else 'DELETE'
+        self.conn.execute(f'PRAGMA journal_mode={journal_mode}')
+        with self.conn:
+            self.conn.execute('BEGIN IMMEDIATE')
+            version = self.conn.execute('PRAGMA user_version').fetchone()[0]
+            if version != SCHEMA_VERSION:
+                # Created by an older version (or new): start from scratch
+                for statement in SCHEMA:
+                    self.conn.execute(statement)
+                index_id = base64.urlsafe_b64encode(os.urandom(6)).decode()
+                self.conn.executemany(
+                        'INSERT INTO state VALUES (?, ?)',
+                        [('id', index_id), ('generation', 0)])
+        # Distinguishes the generations of different index files
+        self.index_id = self.conn.execute(
+                "SELECT value FROM state WHERE key = 'id'").fetchone()[0]
+        # path --> (signature, entry)
+        self.rows = {}
+        self.sorted_notes = self.sorted_keys = None
+        # The generation of the index file that self.rows reflects
+        self.generation = -1
+        self.listeners = []
+        self._sync()
+
+    def scan(self, parallel=False):
+        """Yields (path, dirname, filename, stat, meta) of every note on disk.
+
+        The metadata is only read for notes whose signature differs from the
+        indexed one (meta is None for the others). If parallel is true,
+        directories are listed on a thread pool, one task per directory, and
+        the metadata is also read in the worker threads. This is faster for
+        a cold scan or over a network file system, but slower than a serial
+        walk when the files are in the page cache.
+        """
+        if not parallel:
+            pending = ['']
+            while pending:
+                notes, subdirs = self._scan_dir(pending.pop())
+                pending.extend(reversed(subdirs))
+                yield from notes
+            return
+        with concurrent.futures.ThreadPoolExecutor(self.workers) as pool:
+            pending = {pool.submit(self._scan_dir, '')}
+            while pending:
+                done, pending = concurrent.futures.wait(
+                        pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    notes, subdirs = future.result()
+                    for subdir in subdirs:
+                        pending.add(pool.submit(self._scan_dir, subdir))
+                    yield from notes
+
+    def _scan_dir(self, dirname):
+        """Returns the notes and the subdirectories of a single directory."""
+        notes = []
+        subdirs = []
+        try:
+            with os.scandir(os.path.join(self.data_dir, dirname)) as entries:
+                for entry in entries:
+                    # Like os.walk, do not descend into symlinked directories
+                    if entry.is_dir():
+                        if not entry.is_symlink():
+                            subdirs.append(os.path.join(dirname, entry.name))
+                        continue
+                    if not entry.name.endswith('.md'):
+                        continue
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    path = os.path.join(dirname, entry.name)
+                    cached = self.rows.get(path)
+                    meta = None
+                    if cached is None or cached[0] != stat_signature(st):
+                        meta = self.read_meta(entry.path, st)
+                    notes.append((path, dirname or '.', entry.name, st, meta))
+        except OSError:
+            print(f'Warning: failed to list {dirname}', file=sys.stderr)
+        return notes, subdirs
+
+    def refresh(self):
+        """Re-reads the notes whose signature changed and drops deleted ones.
+
+        Returns True if anything changed.
+        """
+        with self.lock:
+            changed = self._sync()
+            seen = set()
+            updated = []
+            parallel = not self.rows or not self.local
+            for path, dirname, filename, st, meta in self.scan(parallel):
+                seen.add(path)
+                self._update_one(path, dirname, filename, st, updated, meta)
+            deleted = [path for path in self.rows if path not in seen]
+            changed += self._commit(updated, deleted)
+            updated, deleted = self._split(changed)
+        return self._notify(updated, deleted)
+
+    def update(self, paths):
+        """Like refresh(), but only looks at the given note paths."""
+        with self.lock:
+            changed = self._sync()
+            updated = []
+            deleted = []
+            for path in paths:
+                try:
+                    st = os.stat(os.path.join(self.data_dir, path))
+                except OSError:
+                    st = None
+                if st is None or not stat.S_ISREG(st.st_mode):
+                    if path in self.rows:
+                        deleted.append(path)
+                    continue
+                dirname, filename = os.path.split(path)
+                self._update_one(path, dirname or '.', filename, st, updated)
+            changed += self._commit(updated, deleted)
+            updated, deleted = self._split(changed)
+        return self._notify(updated, deleted)
+
+    def sync(self):
+        """Pulls the changes written to the index file by other processes.
+
+        Returns True if anything changed.
+        """
+        with self.lock:
+            updated, deleted = self._split(self._sync())
+        return self._notify(updated, deleted)
+
+    def _update_one(self, path, dirname, filename, st, updated, meta=None):
+        signature = stat_signature(st)
+        cached = self.rows.get(path)
+        if cached is not None and cached[0] == signature:
+            return
+        if meta is None:
+            meta = self.read_meta(os.path.join(self.data_dir, path), st)
+        entry = {
+            'dirname': dirname,
+            'filename': filename,
+            'meta': meta,
+        }
+        updated.append((path, signature, entry))
+
+    def _sync(self):
+        """Pulls the changes from the index file and returns their paths."""
+        with self.conn:
+            self.conn.execute('BEGIN')
+            return self._pull()
+
+    def _pull(self):
+        # Must be called in a transaction to see a consistent snapshot
+        generation = self.conn.execute(
+                "SELECT value FROM state WHERE key = 'generation'").fetchone()[0]
+        if generation == self.generation:
+            return []
+        changed = []
+        rows = self.conn.execute(
+                'SELECT * FROM notes WHERE generation > ?', (self.generation,))
+        for row in rows:
+            path, dirname, filename, mtime_ns, size, inode = row[:6]
+            self.rows[path] = ((mtime_ns, size, inode), {
+                'dirname': dirname,
+                'filename': filename,
+                'meta': {
+                    'index': row[6],
+                    'title': row[7],
+                    'timestamp': row[8],
+                },
+            })
+            changed.append(path)
+        rows = self.conn.execute(
+                'SELECT path FROM deleted WHERE generation > ?', (self.generation,))
+        for path, in rows:
+            if self.rows.pop(path, None) is not None:
+                changed.append(path)
+        self.generation = generation
+        self.sorted_notes = self.sorted_keys = None
+        return changed
+
+    def _commit(self, updated, deleted):
+        """Applies and writes the changes, and returns the changed paths.
+
+        The changes written by other processes since the last sync are
+        pulled first, in the same transaction, so the new generation number
+        covers both.
+        """
+        if not updated and not deleted:
+            return []
+        with self.conn:
+            self.conn.execute('BEGIN IMMEDIATE')
+            changed = self._pull()
+            for path, signature, entry in updated:
+                self.rows[path] = (signature, entry)
+            for path in deleted:
+                self.rows.pop(path, None)
+            self._write(updated, deleted, self.generation + 1)
+            self.generation += 1
+        self.sorted_notes = self.sorted_keys = None
+        return changed + [path for path, _, _ in updated] + deleted
+
+    def _split(self, changed):
+        """Returns the (updated, deleted) lists of the changed paths."""
+        changed = list(dict.fromkeys(changed))
+        return ([path for path in changed if path in self.rows],
+                [path for path in changed if path not in self.rows])
+
+    def _notify(self, updated, deleted):
+        """Calls the listeners (outside the lock) if anything changed."""
+        if not updated and not deleted:
+            return False
+        for listener in self.listeners:
+            listener(updated, deleted)
+        return True
+
+    def _write(self, updated, deleted, generation):
+        self.conn.executemany(
+                'INSERT OR REPLACE INTO notes VALUES (?,?,?,?,?,?,?,?,?,?)',
+                [(path, entry['dirname'], entry['filename'],
+                  *signature,
+                  entry['meta']['index'], entry['meta']['title'],
+                  entry['meta']['timestamp'], generation)
+                 for path, signature, entry in updated])
+        self.conn.executemany(
+                'DELETE FROM deleted WHERE path = ?',
+                [(path,) for path, _, _ in updated])
+        self.conn.executemany(
+                'DELETE FROM notes WHERE path = ?',
+                [(path,) for path in deleted])
+        # Remember the deletions so that other processes can pull them
+        self.conn.executemany(
+                'INSERT OR REPLACE INTO deleted VALUES (?, ?)',
+                [(path, generation) for path in deleted])
+        self.conn.execute(
+                "UPDATE state SET value = ? WHERE key = 'generation'",
+                (generation,))
+
+    def get(self, path):
+        """Returns the entry of the note, or None if it is not indexed."""
+        with self.lock:
+            cached = self.rows.get(path)
+            return cached[1] if cached is not None else None
+
+    def paths(self):
+        with self.lock:
+            return list(self.rows)
+
+    def _sort(self):
+        if self.sorted_notes is None:
+            self.sorted_notes = sorted(
+                    (entry for _, entry in self.rows.values()), key=sort_key)
+            self.sorted_keys = [sort_key(entry) for entry in self.sorted_notes]
+
+    def _dir_range(self, dirname, subtree):
+        """Returns the (start, end) slice of the notes under dirname.
+
+        Since the notes are sorted by dirname first, the notes directly in a
+        directory, and the notes in its subdirectories, are contiguous.
+        """
+        keys = self.sorted_keys
+        if subtree and dirname == '.':
+            return [(0, len(keys))]
+        # '\0' and chr(ord(os.sep) + 1) are the successors of the prefixes
+        ranges = [(
+            bisect.bisect_left(keys, (dirname,)),
+            bisect.bisect_left(keys, (dirname + '\0',)))]
+        if subtree:
+            ranges.append((
+                bisect.bisect_left(keys, (dirname + os.sep,)),
+                bisect.bisect_left(keys, (dirname + chr(ord(os.sep) + 1),))))
+        return ranges
+
+    def notes(self, dirname=None, subtree=False, after=None, limit=None):
+        """Returns the sorted list of note entries.
+
+        - dirname: only return the notes in this directory (and also in its
+          subdirectories if subtree is True).
+        - after: only return the notes whose sort key is larger.
+        - limit: return at most this many notes.
+        """
+        with self.lock:
+            self._sort()
+            if dirname is None:
+                ranges = [(0, len(self.sorted_keys))]
+            else:
+                ranges = self._dir_range(dirname, subtree)
+            notes = []
+            for start, end in ranges:
+                if after is not None:
+                    start = max(start, bisect.bisect_right(
+                        self.sorted_keys, after, start, end))
+                if limit is not None:
+                    end = min(end, start + limit - len(notes))
+                notes.extend(self.sorted_notes[start:end])
+            return notes
+
+    def dirs(self):
+        """Returns the sorted list of (dirname, number of notes)."""
+        with self.lock:
+            self._sort()
+            counts = {}
+            for entry in self.sorted_notes:
+                counts[entry['dirname']] = counts.get(entry['dirname'], 0) + 1
+            return sorted(counts.items())
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+################################
+# Benchmark
+
+def serial_scan(data_dir, read_meta):
+    """The original single-threaded os.walk listing, for comparison."""
+    notes = []
+    for root, dirs, files in os.walk(data_dir):
+        dirname = os.path.relpath(root, data_dir)
+        for filename in files:
+            if not filename.endswith('.md'):
+                continue
+            full_path = os.path.join(root, filename)
+            notes.append({
+                'dirname': dirname,
+                'filename': filename,
+                'meta': read_meta(full_path, os.stat(full_path)),
+            })
+    notes.sort(key=sort_key)
+    return notes
+
+
+def create_notes(data_dir, num_dirs, notes_per_dir):
+    """Fills data_dir with dummy notes."""
+    for i in range(num_dirs):
+        dirname = os.path.join(data_dir, f'dir{i // 10}', f'sub{i}')
+        os.makedirs(dirname)
+        for j in range(notes_per_dir):
+            with open(os.path.join(dirname, f'note{j}.md'), 'w') as fout:
+                print('<!-- {"index": "%d", "title": "Note %d"} -->' % (j, j),
+                      file=fout)
+                fout.write('Lorem ipsum dolor sit amet.\n' * 20)
+
+
+def main():
+    # Compare the serial walk with the parallel cold scan
+    from .app import parse_meta
+    parser = argparse.ArgumentParser()
+    parser.add_argument('data_dir', nargs='?',
+            help='Notes to scan (default: create dummy notes)')
+    parser.add_argument('-d', '--num-dirs', type=int, default=200)
+    parser.add_argument('-n', '--notes-per-dir', type=int, default=50)
+    parser.add_argument('-w', '--workers', type=int, default=SCAN_WORKERS)
+    parser.add_argument('-r', '--repeat', type=int, default=3)
+    parser.add_argument('-l', '--latency', type=float, default=0,
+            help='Simulated latency of each file read in ms (e.g., NFS)')
+    args = parser.parse_args()
+
+    def read_meta(filename, st):
+        time.sleep(args.latency / 1000)
+        try:
+            with open(filename) as fin:
+                return parse_meta(fin.readline())
+        except ValueError:
+            return {'index': '', 'title': '', 'timestamp': 0}
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data_dir = args.data_dir
+        if data_dir is None:
+            data_dir = os.path.join(tmp_dir, 'data')
+            create_notes(data_dir, args.num_dirs, args.notes_per_dir)
+        for i in range(args.repeat):
+            start_time = time.perf_counter()
+            expected = serial_scan(data_dir, read_meta)
+            serial_time = time.perf_counter() - start_time
+
+            start_time = time.perf_counter()
+            index = NoteIndex(':memory:', data_dir, read_meta, args.workers)
+            index.refresh()
+            actual = index.notes()
+            parallel_time = time.perf_counter() - start_time
+            index.close()
+
+            assert actual == expected, 'Scan results differ.'
+            print(f'{len(actual)} notes: serial {serial_time:.3f}s, '
+                  f'parallel ({args.workers} workers) {parallel_time:.3f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+"""In-memory full-text indices over the contents of the notes."""
+import collections
+import heapq
+import math
+import re
+import threading
+
+try:
+    from re import _parser as sre_parse     # Python >= 3.11
+except ImportError:
+    import sre_parse
+
+
+TOKEN_RE = re.compile(r'\w+')
+BM25_K1 = 1.2
+BM25_B = 0.75
+SNIPPET_RADIUS = 80   # characters around the first match
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+
+class SearchIndex:
+    """Inverted index mapping each term to {path: term frequency}."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.postings = collections.defaultdict(dict)
+        # path --> list of distinct terms (for removing the postings)
+        self.doc_terms = {}
+        self.doc_lengths = {}
+        self.total_length = 0
+
+    def update(self, path, text):
+        counts = collections.Counter(tokenize(text))
+        with self.lock:
+            self._remove(path)
+            for term, tf in counts.items():
+                self.postings[term][path] = tf
+            self.doc_terms[path] = list(counts)
+            self.doc_lengths[path] = length = sum(counts.values())
+            self.total_length += length
+
+    def remove(self, path):
+        with self.lock:
+            self._remove(path)
+
+    def _remove(self, path):
+        terms = self.doc_terms.pop(path, None)
+        if terms is None:
+            return
+        for term in terms:
+            postings = self.postings[term]
+            del postings[path]
+            if not postings:
+                del self.postings[term]
+        self.total_length -= self.doc_lengths.pop(path)
+
+    def search(self, query, limit):
+        """Returns [(path, score)] of the best matching notes under BM25."""
+        terms = set(tokenize(query))
+        scores = collections.defaultdict(float)
+        with self.lock:
+            num_docs = len(self.doc_lengths)
+            if not num_docs:
+                return []
+            avg_length = max(self.total_length / num_docs, 1)
+            for term in terms:
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(
+                        1 + (num_docs - len(postings) + .5) / (len(postings) + .5))
+                for path, tf in postings.items():
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B
+                            * self.doc_lengths[path] / avg_length)
+                    scores[path] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+        return heapq.nlargest(limit, scores.items(), key=lambda x: x[1])
+
+
+################################
+# Trigrams
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class TrigramIndex:
+    """Maps each trigram of the lowercased text to the set of paths.
+
+    Used to narrow down the notes that can contain a substring or match a
+    regular expression before actually searching them.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.postings = collections.defaultdict(set)
+        # path --> set of trigrams (for removing the postings)
+        self.doc_trigrams = {}
+
+    def update(self, path, text):
+        doc_trigrams = trigrams(text.lower())
+        with self.lock:
+            self._remove(path)
+            for trigram in doc_trigrams:
+                self.postings[trigram].add(path)
+            self.doc_trigrams[path] = doc_trigrams
+
+    def remove(self, path):
+        with self.lock:
+            self._remove(path)
+
+    def _remove(self, path):
+        doc_trigrams = self.doc_trigrams.pop(path, None)
+        if doc_trigrams is None:
+            return
+        for trigram in doc_trigrams:
+            postings = self.postings[trigram]
+            postings.discard(path)
+            if not postings:
+                del self.postings[trigram]
+
+    def candidates(self, literals):
+        """Returns the paths whose text may contain all of the literals.
+
+        Literals shorter than 3 characters give no constraint.
+        """
+        required = set()
+        for literal in literals:
+            required |= trigrams(literal.lower())
+        with self.lock:
+            if not required:
+                return set(self.doc_trigrams)
+            postings = sorted(
+                    (self.postings.get(trigram, set()) for trigram in required),
+                    key=len)
+            result = set(postings[0])
+            for paths in postings[1:]:
+                if not result:
+                    break
+                result &= paths
+            return result
+
+
+def required_literals(pattern, flags=0):
+    """Returns strings that any match of the regular expression contains.
+
+    Only sequences of literal characters that are always matched are
+    collected; anything else (classes, alternatives, optional parts) just
+    separates the sequences.
+    """
+    literals = []
+    current = []
+
+    def flush():
+        if current:
+            literals.append(''.join(current))
+            current.clear()
+
+    def walk(items):
+        for op, arg in items:
+            if op is sre_parse.LITERAL:
+                current.append(chr(arg))
+            elif op is sre_parse.SUBPATTERN:
+                walk(arg[-1])
+            elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+                min_count, _, item = arg
+                flush()
+                if min_count >= 1:
+                    walk(item)
+                    flush()
+            else:
+                flush()
+
+    walk(sre_parse.parse(pattern, flags))
+    flush()
+    return literals
+
+
+################################
+# Snippets
+
+def make_snippet(text, query, radius=SNIPPET_RADIUS):
+    """Returns the text around the first occurrence of a query term."""
+    terms = sorted(set(tokenize(query)), key=len, reverse=True)
+    position = 0
+    if terms:
+        pattern = r'\b(?:{})\b'.format('|'.join(map(re.escape, terms)))
+        match = re.search(pattern, text, re.IGNORECASE)
+        if match:
+            position = match.start()
+    return snippet_at(text, position, radius)
+
+
+def snippet_at(text, position, radius=SNIPPET_RADIUS):
+    """Returns the text around the given position."""
+    start = max(0, position - radius)
+    snippet = ' '.join(text[start:start + 2 * radius].split())
+    if start > 0:
+        snippet = '...' + snippet
+    if start + 2 * radius < len(text):
+        snippet += '...'
+    return snippet
@@ -0,0 +1,282 @@
+"""Atomic file writes with a configurable fsync policy."""
+import os
+import stat
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+try:
+    import fcntl
+except ImportError:   # Windows
+    fcntl = None
+
+
+FSYNC_POLICIES = ('always', 'interval', 'never')
+FSYNC_INTERVAL = 1.0  # seconds between group commits of the 'interval' policy
+# File systems shared over the network (types as in /proc/mounts)
+NETWORK_FILESYSTEMS = (
+        'nfs', 'nfs4', 'cifs', 'smbfs', 'smb3', 'afs', 'ceph', 'glusterfs',
+        'lustre', '9p', 'fuse.sshfs', 'fuse.glusterfs', 'fuse.rclone')
+
+
+def fsync_dir(dirname):
+    """Makes a rename in the directory durable (not supported on Windows)."""
+    if not hasattr(os, 'O_DIRECTORY'):
+        return
+    fd = os.open(dirname, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def is_local_filesystem(path):
+    """Returns whether path is known to be on a local file system.
+
+    Only Linux (with /proc/mounts) can tell; elsewhere the answer is False.
+    """
+    try:
+        with open('/proc/mounts') as fin:
+            mounts = [line.split()[1:3] for line in fin]
+    except OSError:
+        return False
+    path = os.path.realpath(path)
+    best, fstype = '', None
+    for mount_point, mount_type in mounts:
+        # Spaces and other special characters are escaped as \ooo
+        mount_point = mount_point.encode().decode('unicode_escape')
+        prefix = mount_point.rstrip('/') + '/'
+        if ((path == mount_point or path.startswith(prefix))
+                and len(mount_point) >= len(best)):
+            best, fstype = mount_point, mount_type
+    return fstype is not None and fstype not in NETWORK_FILESYSTEMS
+
+
+class FileLock:
+    """Lock that excludes other threads and, with flock, other processes.
+
+    flock locks belong to the open file, so a process that forks workers
+    must create the lock in each worker after the fork. Where flock is not
+    available, only threads are excluded.
+    """
+
+    def __init__(self, filename):
+        self.lock = threading.Lock()
+        self.file = open(filename, 'a') if fcntl is not None else None
+
+    def __enter__(self):
+        self.lock.acquire()
+        if self.file is not None:
+            try:
+                fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+            except BaseException:
+                self.lock.release()
+                raise
+        return self
+
+    def __exit__(self, *args):
+        if self.file is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+        self.lock.release()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+class FileWriter:
+    """Replaces files atomically by writing a temp file and renaming it.
+
+    A crash leaves either the old or the new content, never a truncated
+    file. Symlinks are followed, and files with several hard links are
+    overwritten in place so that the links stay shared. When the data
+    reaches the disk depends on the policy:
+    - 'always': fsync the file before the rename and the directory after.
+    - 'interval': a background thread fsyncs the files and directories
+      written since the last round every `interval` seconds, so a burst of
+      writes shares one commit. A crash can lose the last interval.
+    - 'never': leave it to the operating system.
+    """
+
+    def __init__(self, policy='always', interval=FSYNC_INTERVAL):
+        if policy not in FSYNC_POLICIES:
+            raise ValueError(f'Unknown fsync policy {policy}')
+        self.policy = policy
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.pending = set()
+        self.stopped = threading.Event()
+        self.thread = None
+        if policy == 'interval':
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def write(self, filename, text):
+        # Replace the file a symlink points to, not the link
+        filename = os.path.realpath(filename)
+        try:
+            if os.stat(filename).st_nlink > 1:
+                # Renaming would split the file from its other hard links
+                self._write_in_place(filename, text)
+                return
+        except FileNotFoundError:
+            pass
+        dirname, basename = os.path.split(filename)
+        fd, tmp_filename = tempfile.mkstemp(
+                prefix=f'.{basename}.', suffix='.tmp', dir=dirname)
+        try:
+            with os.fdopen(fd, 'w') as fout:
+                fout.write(text)
+                if self.policy == 'always':
+                    fout.flush()
+                    os.fsync(fout.fileno())
+            try:
+                mode = stat.S_IMODE(os.stat(filename).st_mode)
+                os.chmod(tmp_filename, mode)
+            except FileNotFoundError:
+                pass
+            os.replace(tmp_filename, filename)
+        except BaseException:
+            try:
+                os.unlink(tmp_filename)
+            except OSError:
+                pass
+            raise
+        if self.policy == 'always':
+            fsync_dir(dirname)
+        elif self.policy == 'interval':
+            with self.lock:
+                self.pending.add(filename)
+
+    def _write_in_place(self, filename, text):
+        """Overwrites the file itself (not atomic)."""
+        with open(filename, 'w') as fout:
+            fout.write(text)
+            if self.policy == 'always':
+                fout.flush()
+                os.fsync(fout.fileno())
+        if self.policy == 'interval':
+            with self.lock:
+                self.pending.add(filename)
+
+    def sync(self):
+        """Fsyncs the files written since the last sync."""
+        with self.lock:
+            pending, self.pending = self.pending, set()
+        for filename in pending:
+            try:
+                fd = os.open(filename, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            except OSError as e:
+                print(f'Warning: failed to fsync {filename}: {e}', file=sys.stderr)
+        for dirname in {os.path.dirname(x) for x in pending}:
+            try:
+                fsync_dir(dirname)
+            except OSError as e:
+                print(f'Warning: failed to fsync {dirname}: {e}', file=sys.stderr)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.sync()
+
+    def close(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.sync()
+
+
+class WriteBehindQueue:
+    """Writes files in a background thread, coalescing repeated writes.
+
+    write() only records the latest text of the file. A file is written
+    `delay` seconds after its first pending write, so a burst of writes to
+    the same file costs a single write. on_written(filename, text) is
+    called from the background thread after each write.
+    """
+
+    def __init__(self, writer, delay, on_written=None):
+        self.writer = writer
+        self.delay = delay
+        self.on_written = on_written
+        self.cond = threading.Condition()
+        # filename --> (latest text, time when it is due)
+        self.pending = {}
+        self.stopped = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def write(self, filename, text):
+        with self.cond:
+            if filename in self.pending:
+                due = self.pending[filename][1]
+            else:
+                due = time.monotonic() + self.delay
+            self.pending[filename] = (text, due)
+            self.cond.notify()
+
+    def get(self, filename):
+        """Returns the text waiting to be written to the file, or None."""
+        with self.cond:
+            pending = self.pending.get(filename)
+            return pending[0] if pending is not None else None
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.stopped:
+                    now = time.monotonic()
+                    ready = [(filename, text)
+                             for filename, (text, due) in self.pending.items()
+                             if due <= now]
+                    if ready:
+                        break
+                    next_due = min(
+                            (due for _, due in self.pending.values()),
+                            default=now + self.delay)
+                    self.cond.wait(next_due - now)
+                if self.stopped:
+                    return
+            self._write(ready)
+
+    def _write(self, items):
+        for filename, text in items:
+            try:
+                self.writer.write(filename, text)
+            except Exception:
+                print(f'Warning: failed to write {filename}', file=sys.stderr)
+                traceback.print_exc()
+                # Retry later
+                with self.cond:
+                    if self.pending.get(filename, (None,))[0] is text:
+                        self.pending[filename] = (
+                                text, time.monotonic() + self.delay)
+                continue
+            with self.cond:
+                # Keep the entry if a newer text arrived meanwhile
+                if self.pending.get(filename, (None,))[0] is text:
+                    del self.pending[filename]
+            if self.on_written is not None:
+                try:
+                    self.on_written(filename, text)
+                except Exception:
+                    traceback.print_exc()
+
+    def flush(self):
+        """Writes all pending files now."""
+        with self.cond:
+            items = [(filename, text)
+                     for filename, (text, _) in self.pending.items()]
+        self._write(items)
+
+    def close(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify()
+        self.thread.join()
+        self.flush()
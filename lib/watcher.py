@@ -0,0 +1,162 @@
+"""Background watchers that report changes to notes under a directory.
+
+The callback on_change(paths) receives a set of changed note paths
+(relative to the watched directory), or None if the whole tree should be
+rescanned (e.g., a directory was moved or the event queue overflowed).
+Other kinds of files can be watched by changing the suffix.
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import threading
+import traceback
+
+
+POLL_INTERVAL = 5     # seconds between rescans of the polling watcher
+
+# Constants from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o0004000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (
+        IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+        | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+EVENT_HEADER = struct.Struct('iIII')
+
+
+class Watcher:
+
+    def __init__(self, root, on_change):
+        self.root = root
+        self.on_change = on_change
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def notify(self, paths):
+        try:
+            self.on_change(paths)
+        except Exception:
+            traceback.print_exc()
+
+    def run(self):
+        raise NotImplementedError
+
+
+class PollingWatcher(Watcher):
+    """Asks for a full rescan every `interval` seconds."""
+
+    def __init__(self, root, on_change, interval=POLL_INTERVAL):
+        super().__init__(root, on_change)
+        self.interval = interval
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.notify(None)
+
+
+class InotifyWatcher(Watcher):
+    """Watches every directory under root with Linux inotify.
+
+    Only changes to files whose names end with suffix are reported.
+    """
+
+    def __init__(self, root, on_change, suffix='.md'):
+        super().__init__(root, on_change)
+        self.suffix = suffix
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.add_watch = libc.inotify_add_watch
+        self.add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        # watch descriptor --> directory relative to root
+        self.dirs = {}
+        self.watch_tree('.')
+
+    def watch_tree(self, dirname):
+        """Adds watches on dirname and all of its subdirectories."""
+        for root, dirs, files in os.walk(os.path.join(self.root, dirname)):
+            wd = self.add_watch(self.fd, os.fsencode(root), WATCH_MASK)
+            if wd < 0:
+                print(f'Warning: cannot watch {root}', file=sys.stderr)
+                continue
+            self.dirs[wd] = os.path.relpath(root, self.root)
+
+    def run(self):
+        try:
+            while not self.stopped.is_set():
+                readable, _, _ = select.select([self.fd], [], [], 1.0)
+                if readable:
+                    changed = self.read_events()
+                    if changed is None or changed:
+                        self.notify(changed)
+        finally:
+            os.close(self.fd)
+
+    def read_events(self):
+        """Returns the set of changed note paths, or None to rescan."""
+        try:
+            buf = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return set()
+        changed = set()
+        rescan = False
+        offset = 0
+        while offset < len(buf):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(buf, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(buf[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                rescan = True
+                continue
+            if mask & IN_IGNORED:
+                self.dirs.pop(wd, None)
+                continue
+            dirname = self.dirs.get(wd)
+            if dirname is None:
+                continue
+            path = os.path.normpath(os.path.join(dirname, name))
+            if mask & IN_ISDIR:
+                # A whole subtree appeared or disappeared
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self.watch_tree(path)
+                rescan = True
+            elif mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                rescan = True
+            elif name.endswith(self.suffix):
+                changed.add(path)
+        return None if rescan else changed
+
+
+def create_watcher(root, on_change, suffix='.md'):
+    """Returns an inotify watcher if available, or a polling watcher."""
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(root, on_change, suffix)
+        except (OSError, AttributeError) as e:
+            print(f'Warning: inotify is not available ({e})', file=sys.stderr)
+    return PollingWatcher(root, on_change)
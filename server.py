@@ -11,11 +11,49 @@ BASEDIR = os.path.dirname(os.path.abspath(__file__))
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('-p', '--port', type=int, default=8089)
+    parser.add_argument('--fsync', default='always',
+            choices=['always', 'interval', 'never'],
+            help='When to flush saved notes to the disk')
+    parser.add_argument('--fsync-interval', type=float, default=1.0,
+            help='Seconds between flushes for --fsync interval')
+    parser.add_argument('--write-behind', type=float, metavar='SECONDS',
+            help='Write saved notes in the background after this delay, '
+                 'merging repeated saves of the same note')
+    parser.add_argument('--note-cache', type=float, default=64, metavar='MB',
+            help='Memory budget for caching the contents of recently '
+                 'loaded notes (0 to disable)')
+    parser.add_argument('--threads', type=int, default=10,
+            help='Number of requests served concurrently '
+                 '(0 to serve one request at a time)')
+    parser.add_argument('--workers', type=int, default=1,
+            help='Number of server processes (Unix only; cannot be used '
+                 'with --write-behind)')
+    parser.add_argument('--keep-alive', type=float, metavar='SECONDS',
+            help='Keep connections open for more requests until they are '
+                 'idle for this long (requires --threads)')
+    parser.add_argument('--gzip-min-size', type=int, default=1024,
+            metavar='BYTES',
+            help='Compress dynamic responses of at least this size')
+    parser.add_argument('--static-cache', action='store_true',
+            help='Keep the static files in memory')
+    parser.add_argument('--no-bundle', action='store_true',
+            help='Load the scripts and stylesheets of the pages as separate '
+                 'files instead of minified bundles (for debugging)')
     args = parser.parse_args()
+    if args.workers > 1 and args.write_behind is not None:
+        parser.error('--workers cannot be used with --write-behind')
+    if args.keep_alive and args.threads <= 0:
+        parser.error('--keep-alive requires --threads')
 
     from lib.app import start
     try:
-        start(args.port, BASEDIR)
+        start(args.port, BASEDIR,
+              fsync_policy=args.fsync, fsync_interval=args.fsync_interval,
+              write_behind=args.write_behind,
+              note_cache_bytes=int(args.note_cache * 1024 * 1024),
+              threads=args.threads, workers=args.workers,
+              keepalive=args.keep_alive, gzip_min_size=args.gzip_min_size,
+              static_cache=args.static_cache, bundle=not args.no_bundle)
     except:
         traceback.print_exc()
 
@@ -3,8 +3,15 @@ $(function () {
 
   const EXPORT_BASE_URL = '/a9online', EDITOR_BASE_URL = '/data';
   const BUFFER_DELAY = 800;
+  // Notes at least this long are saved by uploading only the changes
+  const PATCH_MIN_LENGTH = 4096;
 
   let myCodeMirror, notePath, changeTimeout = null, changeLatestTime;
+  // Content and version token of the note as last loaded or saved
+  let savedContent = null, noteVersion = null;
+  // Whether a save request is in flight, and the save to send after it
+  // (null, or the overwrite argument)
+  let saving = false, queuedSave = null;
 
   // ################################################
   // Utilities
@@ -27,6 +34,33 @@ $(function () {
     return text.replace(/[&<>"']/g, function (m) { return _ESCAPE_HTML_MAP[m]; });
   }
 
+  // Returns a single edit {from, to, text} that turns oldText into newText.
+  function diffText(oldText, newText) {
+    let maxPrefix = Math.min(oldText.length, newText.length), prefix = 0;
+    while (prefix < maxPrefix
+        && oldText.charCodeAt(prefix) === newText.charCodeAt(prefix)) {
+      prefix++;
+    }
+    let maxSuffix = maxPrefix - prefix, suffix = 0;
+    while (suffix < maxSuffix
+        && oldText.charCodeAt(oldText.length - 1 - suffix)
+          === newText.charCodeAt(newText.length - 1 - suffix)) {
+      suffix++;
+    }
+    // Do not split surrogate pairs
+    if (prefix > 0 && /[\uD800-\uDBFF]/.test(oldText.charAt(prefix - 1))) {
+      prefix--;
+    }
+    if (suffix > 0 && /[\uDC00-\uDFFF]/.test(oldText.charAt(oldText.length - suffix))) {
+      suffix--;
+    }
+    return {
+      from: prefix,
+      to: oldText.length - suffix,
+      text: newText.slice(prefix, newText.length - suffix),
+    };
+  }
+
   // ################################################
   // Messages and Modals
 
@@ -51,6 +85,27 @@ $(function () {
     MODAL.showModal(errorModal);
   }
 
+  // Conflict
+
+  let conflictModal = MODAL.createModal(
+    'Conflict',
+    'The note has been modified elsewhere since it was loaded.',
+    [
+      $('<button type="button">').text('Overwrite').click(function () {
+        MODAL.hideModals();
+        saveNote(true);
+      }),
+      $('<button type="button">').text('Cancel').click(MODAL.hideModals),
+    ]);
+
+  function showSaveError(message) {
+    if (message.status === 409) {
+      MODAL.showModal(conflictModal);
+    } else {
+      showErrorModal(message);
+    }
+  }
+
   // Rename
 
   let renameModal = MODAL.createModal(
@@ -122,6 +177,70 @@ $(function () {
     }
   }
 
+  // Backlinks
+
+  let backlinksModal = MODAL.createModal(
+    'Backlinks',
+    $('<ul id="backlinks-list">'),
+    $('<button type="button">').text('Close').click(MODAL.hideModals));
+
+  function showBacklinksModal() {
+    $.get('/api/backlinks', {path: notePath}, function (data) {
+      let list = $('#backlinks-list').empty();
+      if (!data.backlinks.length) {
+        $('<li class="none">').text('No notes link here.').appendTo(list);
+      }
+      data.backlinks.forEach(function (entry) {
+        let linkHref = (entry.dirname + '/' + entry.filename).replace(/^\.\//, '');
+        $('<li>').appendTo(list).append(
+          $('<a>').attr('href', EDITOR_BASE_URL + '/' + linkHref)
+            .text(entry.meta.title.trim() || '(untitled)'),
+          $('<span class="path">').text(' @/' + linkHref));
+      });
+      MODAL.showModal(backlinksModal);
+    }).fail(showErrorModal);
+  }
+
+  $('#button-backlinks').click(showBacklinksModal);
+
+  // History
+
+  let historyModal = MODAL.createModal(
+    'History',
+    $('<ul id="history-list">'),
+    $('<button type="button">').text('Close').click(MODAL.hideModals));
+
+  function showHistoryModal() {
+    $.get('/api/history', {path: notePath}, function (data) {
+      let list = $('#history-list').empty();
+      if (!data.revisions.length) {
+        $('<li class="none">').text('No past revisions.').appendTo(list);
+      }
+      data.revisions.forEach(function (entry) {
+        let time = new Date(entry.timestamp * 1000).toLocaleString();
+        $('<li>').appendTo(list).append(
+          $('<a href="#">').text(time).click(function () {
+            restoreRevision(entry.revision);
+            return false;
+          }),
+          $('<span class="size">').text(' (' + entry.size + ' characters)'));
+      });
+      MODAL.showModal(historyModal);
+    }).fail(showErrorModal);
+  }
+
+  // Put the revision in the editor; it is only written when saved.
+  function restoreRevision(revision) {
+    $.get('/api/revision', {path: notePath, revision: revision}, function (data) {
+      MODAL.hideModals();
+      setTitle(data.meta.index, data.meta.title);
+      myCodeMirror.setValue(data.content);
+      showMessage('Restored a past revision (not saved yet)');
+    }).fail(showErrorModal);
+  }
+
+  $('#button-history').click(showHistoryModal);
+
   // Cite
 
   // Prevent stale AJAX results
@@ -396,6 +515,8 @@ $(function () {
   }
 
   function displayNote(data) {
+    savedContent = data.content;
+    noteVersion = data.version;
     setTitle(data.meta.index, data.meta.title);
     myCodeMirror.setValue(data.content);
     myCodeMirror.markClean();
@@ -420,20 +541,57 @@ $(function () {
       $('#header-title').text() + ' - a9v2');
   }
 
-  function saveNote() {
+  // Unless overwrite is true, the save fails with 409 if the note has been
+  // modified since it was loaded or saved. A save requested while another
+  // is in flight is sent after it, based on the version it returns.
+  function saveNote(overwrite) {
+    overwrite = overwrite === true;
+    if (saving) {
+      queuedSave = queuedSave === true || overwrite;
+      return;
+    }
+    let content = myCodeMirror.getValue(), url = '/api/save', headers = {};
     let data = {
       path: notePath,
       index: $('#header-index').data('value'),
       title: $('#header-title').data('value'),
-      content: myCodeMirror.getValue(),
     };
-    $.post('/api/save', data, function (data) {
+    if (overwrite || noteVersion === null) {
+      data.content = content;
+    } else if (content.length >= PATCH_MIN_LENGTH) {
+      url = '/api/patch';
+      data.base = noteVersion;
+      data.edits = JSON.stringify([diffText(savedContent, content)]);
+    } else {
+      data.content = content;
+      headers['If-Match'] = '"' + noteVersion + '"';
+    }
+    saving = true;
+    $.ajax({
+      url: url,
+      method: 'POST',
+      data: data,
+      headers: headers,
+    }).done(function (response) {
+      saving = false;
+      savedContent = content;
+      noteVersion = response.version;
+      if (queuedSave !== null) {
+        let queued = queuedSave;
+        queuedSave = null;
+        saveNote(queued);
+        return;
+      }
       showMessage('Saved!');
       myCodeMirror.markClean();
-    }).fail(showErrorModal);
+    }).fail(function (message) {
+      saving = false;
+      queuedSave = null;
+      showSaveError(message);
+    });
   }
 
-  $('#button-save').click(saveNote);
+  $('#button-save').click(function () { saveNote(); });
 
   function exportNote(path, title) {
     let div = $('<div>').appendTo('body')
@@ -4,6 +4,8 @@ $(function () {
   const OPEN_LINK_PREFIX = '/editor.html?path=';
   const COPY_LINK_PREFIX = '@/';
   const RIGHT_ARROW = '\u25BA', DOWN_ARROW = '\u25BC';
+  const PAGE_SIZE = 500;
+  const SEARCH_DELAY = 300;
 
   // ################################################
   // Utilities
@@ -34,35 +36,93 @@ $(function () {
   // ################################################
   // Load the note list
 
+  // Only the directories are loaded at first. The notes of a directory
+  // are loaded when the directory is opened, or all at once on search.
   function loadList() {
-    $.get('/api/list', displayList).fail(showError);
+    $.get('/api/dirs', displayList).fail(showError);
   }
 
   // noteIndex --> {entry (loaded JSON), row (JQuery obj)}
   const allNotes = [];
-  // list of dirnames / list of {notes (list of noteIndices), row (JQuery obj)}
+  // list of dirnames / list of {notes (list of noteIndices, or null if not
+  // loaded yet), row (JQuery obj)}
   const dirnames = [], dirData = [];
+  // Whether the notes of all directories have been requested
+  let allNotesRequested = false;
+  // dirname + '/' + filename --> noteIndex
+  const noteIndexByPath = {};
 
   function displayList(data) {
     $('#notes-table > tbody').empty();
-    data.notes.forEach(function (entry, noteIndex) {
-      let dirIndex = dirnames.indexOf(entry.dirname);
-      if (dirIndex === -1) {
-        dirIndex = dirnames.length;
-        dirnames.push(entry.dirname);
-        dirData[dirIndex] = {
-          notes: [],
-          row: createDirRow(entry.dirname, dirIndex),
-        };
+    data.dirs.forEach(function (dir, dirIndex) {
+      dirnames.push(dir.dirname);
+      dirData[dirIndex] = {
+        notes: null,
+        row: createDirRow(dir.dirname, dirIndex),
+      };
+    });
+    showAllRows();
+  }
+
+  // Fetch the notes page by page, then call callback with all of them.
+  function fetchNotes(params, callback, fetched) {
+    fetched = fetched || [];
+    $.get('/api/list', Object.assign({limit: PAGE_SIZE}, params), function (data) {
+      fetched = fetched.concat(data.notes);
+      if (data.next === null) {
+        callback(fetched);
+      } else {
+        fetchNotes(Object.assign({}, params, {cursor: data.next}), callback, fetched);
       }
+    }).fail(showError);
+  }
+
+  function addNotes(notes) {
+    notes.forEach(function (entry) {
+      let dirIndex = dirnames.indexOf(entry.dirname);
+      if (dirIndex === -1) return;
+      let noteIndex = allNotes.length;
       dirData[dirIndex].notes.push(noteIndex);
+      noteIndexByPath[entry.dirname + '/' + entry.filename] = noteIndex;
       allNotes[noteIndex] = {
         entry: entry,
         row: createNoteRow(entry, noteIndex),
         searchKey: getSearchKey(entry),
       };
     });
-    showAllRows();
+  }
+
+  function loadDirNotes(dirIndex, callback) {
+    if (dirData[dirIndex].notes !== null) {
+      callback();
+      return;
+    }
+    dirData[dirIndex].notes = [];
+    fetchNotes({dir: dirnames[dirIndex]}, function (notes) {
+      addNotes(notes);
+      callback();
+    });
+  }
+
+  function loadAllNotes(callback) {
+    if (allNotesRequested) {
+      callback();
+      return;
+    }
+    allNotesRequested = true;
+    fetchNotes({}, function (notes) {
+      // Skip the directories that are already (being) loaded.
+      let loaded = dirData.map(function (dirDatum) {
+        let isLoaded = (dirDatum.notes !== null);
+        dirDatum.notes = dirDatum.notes || [];
+        return isLoaded;
+      });
+      addNotes(notes.filter(function (entry) {
+        let dirIndex = dirnames.indexOf(entry.dirname);
+        return dirIndex !== -1 && !loaded[dirIndex];
+      }));
+      callback();
+    });
   }
 
   function createDirRow(dirname, dirIndex) {
@@ -135,7 +195,7 @@ $(function () {
     let tbody = $('#notes-table > tbody').empty();
     dirData.forEach(function (dirDatum) {
       dirDatum.row.appendTo(tbody);
-      if (dirDatum.row.hasClass('open')) {
+      if (dirDatum.row.hasClass('open') && dirDatum.notes !== null) {
         dirDatum.notes.forEach(function (noteIndex) {
           allNotes[noteIndex].row.appendTo(tbody);
         });
@@ -145,13 +205,67 @@ $(function () {
 
   function showFilteredRows(filters) {
     let tbody = $('#notes-table > tbody').empty();
-    allNotes.forEach(function (noteDatum) {
-      for (let i = 0; i < filters.length; i++) {
-        if (noteDatum.searchKey.indexOf(filters[i]) !== -1) {
-          noteDatum.row.appendTo(tbody);
-          return;
+    dirData.forEach(function (dirDatum) {
+      (dirDatum.notes || []).forEach(function (noteIndex) {
+        let noteDatum = allNotes[noteIndex];
+        for (let i = 0; i < filters.length; i++) {
+          if (noteDatum.searchKey.indexOf(filters[i]) !== -1) {
+            noteDatum.row.appendTo(tbody);
+            return;
+          }
         }
-      }
+      });
+    });
+  }
+
+  // ################################################
+  // Content search
+
+  // Prevent stale AJAX results
+  let searchTimeout = null, latestSearchQuery = null;
+  // {query, hits} of the last content search
+  let lastSearch = null;
+
+  function scheduleContentSearch(query) {
+    clearTimeout(searchTimeout);
+    latestSearchQuery = query;
+    if (query === "") return;
+    // "..." searches for a substring, and /.../ for a regular expression
+    let params = {q: query}, match;
+    if ((match = /^"(.+)"$/.exec(query)) !== null) {
+      params = {q: match[1], mode: 'substring'};
+    } else if ((match = /^\/(.+)\/$/.exec(query)) !== null) {
+      params = {q: match[1], mode: 'regex'};
+    }
+    searchTimeout = setTimeout(function () {
+      $.get('/api/search', params, function (data) {
+        if (latestSearchQuery !== query) return;
+        lastSearch = {query: query, hits: data.hits};
+        showSearchHits(data.hits);
+      }).fail(function (message) {
+        // Incomplete regular expressions are common while typing
+        if (message.status === 400 && message.responseJSON) {
+          showMessage(message.responseJSON.error);
+        } else {
+          showError(message);
+        }
+      });
+    }, SEARCH_DELAY);
+  }
+
+  function showSearchHits(hits) {
+    let tbody = $('#notes-table > tbody');
+    tbody.find('tr.search-hit').remove();
+    $('<tr class="search-hit search-header">').appendTo(tbody)
+      .append($('<td colspan=6>').text(
+        hits.length ? 'Content matches' : 'No content matches'));
+    hits.forEach(function (hit) {
+      let noteIndex = noteIndexByPath[hit.dirname + '/' + hit.filename];
+      if (noteIndex === undefined) return;
+      allNotes[noteIndex].row.clone().addClass('search-hit').appendTo(tbody);
+      $('<tr class="search-hit snippet">').appendTo(tbody)
+        .append($('<td colspan=3>'))
+        .append($('<td colspan=3>').text(hit.snippet));
     });
   }
 
@@ -162,7 +276,7 @@ $(function () {
   $('#notes-table').on('click', 'tr.dir', function (e) {
     let dirIndex = $(this).attr('data-id');
     dirData[dirIndex].row.toggleClass('open');
-    showAllRows();
+    loadDirNotes(dirIndex, refreshRows);
   });
 
   // Make the title cell a link.
@@ -192,13 +306,26 @@ $(function () {
   });
 
   // Filter
-  $('#header-search').on('input', function (e) {
-    let value = $(this).val().trim().toLowerCase();
+  function refreshRows() {
+    let value = $('#header-search').val().trim();
     if (value === "") {
       showAllRows();
     } else {
-      showFilteredRows(value.split(/\s+/));
+      showFilteredRows(value.toLowerCase().split(/\s+/));
+      if (lastSearch !== null && lastSearch.query === value) {
+        showSearchHits(lastSearch.hits);
+      }
+    }
+  }
+
+  $('#header-search').on('input', function (e) {
+    let value = $(this).val().trim();
+    if (value === "") {
+      refreshRows();
+    } else {
+      loadAllNotes(refreshRows);
     }
+    scheduleContentSearch(value);
   });
 
   // ################################################